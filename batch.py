@@ -0,0 +1,244 @@
+"""
+This module runs Codriver without a prompt: inputs come from a file or stdin, one per line
+(plain text or JSON like {"id": "job-12", "input": "cat job-12.log |? why did this fail"}),
+and every result is written as a JSON line.
+Items with isolated histories run concurrently, up to a limit, and back off together when rate limited.
+"""
+
+import concurrent.futures
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+import cache
+import conversation
+import executor
+import intent
+import modellogic
+
+# Items processed at once when each has its own history.
+batchConcurrency = int(os.environ.get('batchConcurrency') or 4)
+# Retries of an item after a rate limit or connection error before it is reported as failed.
+batchMaxRetries = int(os.environ.get('batchMaxRetries') or 5)
+
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+
+
+class Backoff:
+    """Pauses every worker after a rate limit, doubling the pause while limits keep coming."""
+
+    def __init__(self, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+        self.base = base
+        self.cap = cap
+        self.delay = 0.0
+        self.resume_at = 0.0
+        self.hits = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self._lock:
+                remaining = self.resume_at - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def hit(self, retry_after=None):
+        """Records a rate limit, honouring the server's Retry-After seconds when it sent one."""
+        with self._lock:
+            self.hits += 1
+            self.delay = min(self.cap, self.delay * 2 if self.delay else self.base)
+            pause = retry_after if retry_after is not None else self.delay * random.uniform(1.0, 1.5)
+            self.resume_at = max(self.resume_at, time.monotonic() + pause)
+
+    def succeeded(self):
+        with self._lock:
+            self.delay = 0.0
+
+
+def retry_after(error):
+    """Seconds the server asked us to wait in a Retry-After header, or None."""
+    response = getattr(error, 'response', None)
+    try:
+        return float(response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def is_retryable(error):
+    """Rate limits, overloaded servers and dropped connections, judged without importing the SDK."""
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return type(error).__name__ in ('APIConnectionError', 'APITimeoutError')
+
+
+def read_items(source):
+    """
+    Yields {'id', 'input', optional 'intent'} for every non-empty line of source.
+    A line that isn't usable yields {'id', 'input', 'error'} instead, so it is reported and the batch goes on.
+    """
+    for number, line in enumerate(source, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith('{'):
+            yield {'id': number, 'input': line}
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            yield {'id': number, 'input': line, 'error': f"Invalid JSON: {e}"}
+            continue
+        if not isinstance(item, dict) or not isinstance(item.get('input'), str):
+            yield {'id': item.get('id', number) if isinstance(item, dict) else number, 'input': line,
+                   'error': "Expected a JSON object with an 'input' string"}
+            continue
+        item.setdefault('id', number)
+        yield item
+
+
+def classify_input(command, bypass_cache):
+    """QUERY, COMMAND or SHELL for command: locally when obvious, then from the intent cache or the classifier."""
+    user_intent = intent.fast_classify(command)
+    if user_intent:
+        return user_intent
+    model_choice = (os.environ.get('classifyingModel') or "gpt-4.1-nano").strip()
+    intent_key = cache.make_key('intent', command, intent.os_type, model_choice)
+    cached = None if bypass_cache else cache.lookup(intent_key)
+    if cached:
+        return cached[0]
+    user_intent = modellogic.classify(command, model_choice)
+    if user_intent in ('QUERY', 'COMMAND', 'SHELL'):
+        cache.store(intent_key, user_intent)
+    return user_intent
+
+
+def run_item(item, history, execute=False):
+    """
+    Runs one input through the same pipeline as the prompt and returns its result record.
+    Generated commands are only run with execute, since nobody is there to confirm them.
+    """
+    command, bypass_cache = cache.split_bypass(item['input'])
+    result = {'id': item['id'], 'input': item['input']}
+    if '|?' in command:
+        real_command, _, question = (part.strip() for part in command.partition('|?'))
+        completed = executor.run(real_command, echo=False)
+        history.add_output(completed.stdout, completed.stderr)
+        had_output = bool(completed.stdout.strip() or completed.stderr.strip())
+        result.update(intent='PIPE', command=real_command, returncode=completed.returncode)
+        result['answer'] = modellogic.stream_openai(modellogic.pipe_prompt(real_command, question, had_output),
+                                                    history, echo=False)
+        return result
+    user_intent = item.get('intent') or classify_input(command, bypass_cache)
+    result['intent'] = user_intent
+    if user_intent == 'QUERY':
+        result['answer'] = modellogic.stream_openai(command, history, echo=False)
+        return result
+    if user_intent == 'COMMAND':
+        bypass_cache = bypass_cache or cache.refers_to_context(command)
+        command_key = cache.make_key('command', command, intent.os_type, modellogic.get_model())
+        # Nobody confirms commands here, so they are only read from the cache, never stored.
+        cached = None if bypass_cache else cache.lookup(command_key)
+        if cached and cached[1]:
+            command = cached[1]
+            history.append(modellogic.command_request(item['input']))
+            history.append({"role": "assistant", "content": command})
+        else:
+            command = modellogic.command_openai(command, history)
+        result['command'] = command
+        if not execute:
+            return result
+    completed = executor.run(command, echo=False)
+    history.add_output(completed.stdout, completed.stderr)
+    result.update(returncode=completed.returncode, stdout=completed.stdout, stderr=completed.stderr)
+    return result
+
+
+def run_with_retries(item, history, backoff, execute=False):
+    """run_item with rate-limit backoff. Failures become an 'error' field instead of stopping the batch."""
+    if 'error' in item:
+        return {'id': item['id'], 'input': item['input'], 'error': item['error'], 'attempts': 0, 'seconds': 0.0}
+    started = time.perf_counter()
+    attempts = 0
+    while True:
+        backoff.wait()
+        attempts += 1
+        checkpoint = len(history)
+        try:
+            result = run_item(item, history, execute)
+            backoff.succeeded()
+            break
+        except Exception as e:
+            # Drop anything the failed attempt left in history before trying again.
+            while len(history) > checkpoint:
+                history.pop()
+            if is_retryable(e) and attempts <= batchMaxRetries:
+                backoff.hit(retry_after(e))
+                continue
+            result = {'id': item['id'], 'input': item['input'], 'error': f"{type(e).__name__}: {e}"}
+            break
+    result['attempts'] = attempts
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def run_batch(items, system_message, isolated=False, concurrency=None, ordered=True, execute=False):
+    """
+    Yields a result for every item. With isolated histories items run concurrently, in input order
+    or as they complete; a shared history runs them one after another so each sees the ones before it.
+    """
+    backoff = Backoff()
+    if not isolated:
+        history = conversation.ConversationHistory(system_message)
+        for item in items:
+            yield run_with_retries(item, history, backoff, execute)
+        return
+    concurrency = max(1, concurrency or batchConcurrency)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        def submit(item):
+            return pool.submit(run_with_retries, item, conversation.ConversationHistory(system_message), backoff, execute)
+        items = iter(items)
+        # Keep a bounded window in flight so huge inputs aren't all queued at once.
+        pending = [submit(item) for _, item in zip(range(concurrency * 2), items)]
+        while pending:
+            if ordered:
+                done = [pending.pop(0)]
+            else:
+                finished, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                done = [future for future in pending if future in finished]
+                pending = [future for future in pending if future not in finished]
+            for future in done:
+                yield future.result()
+                for item in items:
+                    pending.append(submit(item))
+                    break
+
+
+def main(source, output, system_message, isolated=False, concurrency=None, ordered=True, execute=False):
+    """
+    Runs a batch from the source path ('-' for stdin) to the output path ('-' for stdout).
+    Progress and errors go to stderr so stdout stays valid JSONL. Returns the number of failed items.
+    """
+    failed = 0
+    input_file = sys.stdin if source == '-' else open(source, 'r', encoding='utf-8')
+    output_file = sys.stdout if output == '-' else open(output, 'w', encoding='utf-8')
+    real_stdout = sys.stdout
+    # Anything printed along the way (failover notices and the like) must not end up in the results.
+    sys.stdout = sys.stderr
+    try:
+        for result in run_batch(read_items(input_file), system_message, isolated, concurrency, ordered, execute):
+            failed += 'error' in result
+            output_file.write(json.dumps(result) + "\n")
+            output_file.flush()
+    finally:
+        sys.stdout = real_stdout
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+    return failed
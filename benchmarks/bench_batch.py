@@ -0,0 +1,78 @@
+"""
+Compares batch mode throughput run serially and with concurrent isolated histories,
+against the local fake OpenAI server, so no API calls are made.
+
+    python benchmarks/bench_batch.py [--items 40] [--latency 0.2] [--concurrency 1 4 8] [--max-concurrent 0]
+
+--max-concurrent makes the fake server answer 429 beyond that many requests at once, to exercise the backoff.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_openai_server import FakeConfig, start_server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=40)
+    parser.add_argument('--latency', type=float, default=0.2, help="fake server latency per request")
+    parser.add_argument('--token-rate', type=float, default=0.0, help="fake server tokens per second")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--max-concurrent', type=int, default=0, help="fake server rate limit, 0 for none")
+    args = parser.parse_args()
+
+    config = FakeConfig(latency=args.latency, token_rate=args.token_rate, answer_tokens=40,
+                        max_concurrent=args.max_concurrent)
+    server, port = start_server(config)
+    # Removed at the end, or at exit if the run fails.
+    config_home = tempfile.TemporaryDirectory(prefix='codriver-bench-')
+    os.environ.update({
+        'OPEN_AI_KEY': 'fake-key',
+        'lmstudioIP': '127.0.0.1',
+        'lmstudioPort': str(port),
+        'lmstudioModel': 'fake',
+        'defaultModel': 'fake',
+        'classifyingModel': 'lmstudio',
+        # Measure the backoff against the fake server alone instead of failing over to OpenAI.
+        'failover': 'false',
+        'XDG_CONFIG_HOME': config_home.name,
+    })
+
+    import batch
+    import modellogic
+
+    modellogic.use_backend('lmstudio')
+    system_message = {"role": "system", "content": "You are Codriver."}
+    # Questions about failing jobs, each answered independently.
+    items = [{'id': i, 'input': f"why would build job {i} fail with exit code 137", 'intent': 'QUERY'}
+             for i in range(args.items)]
+
+    print(f"{args.items} items, {args.latency * 1000:.0f} ms fake latency")
+    serial = None
+    for concurrency in args.concurrency:
+        before, limited = config.requests, config.rate_limited
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = list(batch.run_batch(items, system_message, isolated=True, concurrency=concurrency))
+        elapsed = time.perf_counter() - start
+        errors = sum('error' in result for result in results)
+        serial = serial or elapsed
+        print(f"  concurrency {concurrency:>3}: {elapsed:7.2f} s  {len(results) / elapsed:7.1f} items/s  "
+              f"x{serial / elapsed:4.1f}  {config.requests - before} requests, {config.rate_limited - limited} rate limited, "
+              f"{errors} errors")
+    server.shutdown()
+    config_home.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+End-to-end benchmark of Codriver against the local fake OpenAI server, no real API calls.
+Drives the same dispatch as the interactive loop (codriver.handle_command) with scripted inputs and reports:
+
+- startup time (importing codriver in a fresh interpreter)
+- per-turn overhead excluding model and subprocess time, for QUERY, COMMAND, SHELL, |? and @file turns
+- growth of history and memory over a long session, and how much of each prompt the fake server reports as cached
+- subprocess throughput for large outputs, and capture throughput with reduceOutput on and off
+
+    python benchmarks/bench_e2e.py [--turns 200] [--latency 0.05] [--token-rate 0]
+"""
+
+import argparse
+import builtins
+import contextlib
+import io
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_openai_server import FakeConfig, start_server
+
+SCRIPT = [
+    ('QUERY', "how do symbolic links work on linux"),
+    ('COMMAND', "show me how much disk space is left"),
+    ('SHELL', "echo codriver"),
+    ('PIPE', "seq 1 2000 |? how many lines were printed"),
+    ('FILE', "@{file}"),
+    ('QUERY', "what does the attached file do"),
+]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def configure_environment(port, config_home):
+    os.environ.update({
+        'OPEN_AI_KEY': 'fake-key',
+        'lmstudioIP': '127.0.0.1',
+        'lmstudioPort': str(port),
+        'lmstudioModel': 'fake',
+        'defaultModel': 'fake',
+        'classifyingModel': 'lmstudio',
+        'XDG_CONFIG_HOME': config_home,
+        'APPDATA': config_home,
+    })
+
+
+def bench_startup(runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import codriver'], cwd=ROOT, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run_turn(codriver, profiling, command):
+    """Runs one scripted input and returns (wall seconds, profiling record)."""
+    start = time.perf_counter()
+    finished = len(profiling.turns)
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        codriver.handle_command(command)
+        # Answers stream in the background, the turn ends when the answer does.
+        codriver.wait_for_answer()
+    wall = time.perf_counter() - start
+    entry = profiling.end_turn()
+    if entry is None and len(profiling.turns) > finished:
+        entry = profiling.turns[-1]
+    return wall, entry
+
+
+def overhead(wall, entry):
+    """Turn time not spent waiting on the model or a subprocess."""
+    if not entry:
+        return wall
+    spans = entry['spans']
+    return max(wall - spans.get('classify', 0) - spans.get('generate', 0) - spans.get('subprocess', 0), 0)
+
+
+def log_output(size_mb):
+    """Log-like output: timestamped lines with ids, some warnings and errors, colors and a progress bar."""
+    lines = []
+    for i in range(1000):
+        if i % 100 == 0:
+            lines.append(f"2024-05-01 12:00:{i % 60:02d} ERROR worker {i} failed: \"conn {i}\" refused")
+        elif i % 25 == 0:
+            lines.append(f"\x1b[33mwarning\x1b[0m: unused variable x{i}")
+        elif i % 50 == 1:
+            lines.append(f"  {i % 100}% [=====>     ]\r  {i % 100 + 1}% [======>    ]")
+        else:
+            lines.append(f"2024-05-01 12:00:{i % 60:02d} INFO request {i} served in {i % 97}ms id=0x{i:08x}")
+    block = "\n".join(lines) + "\n"
+    return block * max(1, size_mb * 1024 * 1024 // len(block))
+
+
+def bench_capture(executor, text):
+    """MB/s of writing text to a capture buffer in pipe-sized reads, as the reader threads do."""
+    start = time.perf_counter()
+    capture = executor.make_capture()
+    for position in range(0, len(text), executor.READ_SIZE):
+        capture.write(text[position:position + executor.READ_SIZE])
+    kept = capture.getvalue()
+    return len(text) / 1e6 / (time.perf_counter() - start), len(kept)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, default=200, help="turns in the long-session run")
+    parser.add_argument('--latency', type=float, default=0.0, help="fake server latency per request")
+    parser.add_argument('--token-rate', type=float, default=0.0, help="fake server tokens per second")
+    parser.add_argument('--startup-runs', type=int, default=5)
+    args = parser.parse_args()
+
+    config = FakeConfig(latency=args.latency, token_rate=args.token_rate, answer_tokens=80,
+                        classifications={text: kind for kind, text in SCRIPT if kind in ('QUERY', 'COMMAND', 'SHELL')})
+    server, port = start_server(config)
+    # Removed at the end, or at exit if the run fails.
+    temporary = tempfile.TemporaryDirectory(prefix='codriver-bench-')
+    config_home = temporary.name
+    configure_environment(port, config_home)
+
+    startup = bench_startup(args.startup_runs)
+    print(f"startup (import codriver)   p50 {statistics.median(startup) * 1000:8.1f} ms   max {max(startup) * 1000:8.1f} ms")
+
+    import codriver
+    import modellogic
+    import profiling
+    import executor
+
+    modellogic.use_backend('lmstudio')
+    builtins.input = lambda prompt='': 'y'
+
+    attached = os.path.join(config_home, 'attached.py')
+    with open(attached, 'w', encoding='utf-8') as f:
+        for i in range(2000):
+            f.write(f"def function_{i}(value):\n    return value * {i}\n\n")
+
+    per_kind = {}
+    for kind, text in SCRIPT * 5:
+        wall, entry = run_turn(codriver, profiling, text.format(file=attached))
+        per_kind.setdefault(kind, []).append(overhead(wall, entry))
+    print("per-turn overhead, excluding model and subprocess time:")
+    for kind, values in per_kind.items():
+        print(f"  {kind:<8} p50 {statistics.median(values) * 1000:8.2f} ms   p95 {percentile(values, 0.95) * 1000:8.2f} ms")
+
+    codriver.reset_convo_history()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    checkpoints = sorted({args.turns // 4, args.turns // 2, args.turns})
+    print("long session (history and traced memory):")
+    cached = reported = 0
+    for turn in range(1, args.turns + 1):
+        kind, text = SCRIPT[turn % 4]
+        _, entry = run_turn(codriver, profiling, text.format(file=attached))
+        if entry and 'cached_tokens' in entry['metrics']:
+            cached += entry['metrics']['cached_tokens']
+            reported += entry['metrics']['reported_prompt_tokens']
+        if turn in checkpoints:
+            memory = tracemalloc.get_traced_memory()[0] - baseline
+            print(f"  turn {turn:>5}: {len(codriver.history):>5} messages, {codriver.history.total_tokens:>7} tokens, "
+                  f"+{memory / 1024:8.1f} KiB")
+    tracemalloc.stop()
+    if reported:
+        print(f"prompt cache: {cached / reported:.0%} of {reported} prompt tokens shared a prefix with an earlier request")
+
+    size_mb = 50
+    command = f'"{sys.executable}" -c "import sys; sys.stdout.write((\'x\' * 1023 + chr(10)) * {size_mb * 1024})"'
+    start = time.perf_counter()
+    result = executor.run(command, echo=False)
+    elapsed = time.perf_counter() - start
+    print(f"subprocess throughput: {size_mb / elapsed:8.1f} MB/s for {size_mb} MB, kept {len(result.stdout)} chars")
+    text = log_output(size_mb)
+    reduce_output = executor.reduceOutput
+    for executor.reduceOutput in (False, True):
+        rate, kept = bench_capture(executor, text)
+        print(f"capture throughput, reduceOutput {'on ' if executor.reduceOutput else 'off'}: {rate:8.1f} MB/s "
+              f"for {len(text) / 1e6:.0f} MB of log lines, kept {kept} chars")
+    executor.reduceOutput = reduce_output
+    print(f"fake server handled {config.requests} requests")
+    server.shutdown()
+    temporary.cleanup()
+
+
+if __name__ == "__main__":
+    main()
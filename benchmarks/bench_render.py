@@ -0,0 +1,88 @@
+"""
+Compares writing a streamed answer one print() per token with the frame-based renderer:
+terminal writes made and time spent on the streaming thread, for a markdown answer with code blocks.
+
+    python benchmarks/bench_render.py [--tokens 5000] [--token-rate 200] [--fps 30]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import render
+
+
+class CountingSink:
+    """Stands in for the terminal, counting writes instead of showing them."""
+
+    def __init__(self):
+        self.writes = 0
+        self.chars = 0
+
+    def write(self, text):
+        self.writes += 1
+        self.chars += len(text)
+
+    def flush(self):
+        pass
+
+
+def answer_tokens(count):
+    """A markdown answer in token-sized pieces: prose with **bold** and `code`, headings and fenced code."""
+    paragraph = "Use `grep -r` to search **every** file under the folder, then pipe it to sort.\n".split(' ')
+    block = ["```bash\n", "find . ", "-name '*.log' ", "# old logs\n", "```\n"]
+    tokens = []
+    while len(tokens) < count:
+        tokens += ["## ", "Step\n"] + [word + ' ' for word in paragraph] + block
+    return tokens[:count]
+
+
+def per_token(tokens, delay):
+    sink = CountingSink()
+    busy = 0.0
+    for token in tokens:
+        start = time.perf_counter()
+        print(token, end='', file=sink, flush=True)
+        busy += time.perf_counter() - start
+        if delay:
+            time.sleep(delay)
+    return sink, busy
+
+
+def framed(tokens, delay, fps, markdown):
+    sink = CountingSink()
+    renderer = render.Renderer(fps=fps, markdown=markdown, stream=sink)
+    busy = 0.0
+    for token in tokens:
+        start = time.perf_counter()
+        renderer.write(token)
+        busy += time.perf_counter() - start
+        if delay:
+            time.sleep(delay)
+    renderer.close()
+    return sink, busy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tokens', type=int, default=5000)
+    parser.add_argument('--token-rate', type=float, default=200, help="tokens per second, 0 to write as fast as possible")
+    parser.add_argument('--fps', type=float, default=30)
+    args = parser.parse_args()
+
+    tokens = answer_tokens(args.tokens)
+    delay = 1.0 / args.token_rate if args.token_rate else 0.0
+    print(f"{len(tokens)} tokens at {args.token_rate or 'unlimited'} tokens/s")
+    for label, run in (("print per token", lambda: per_token(tokens, delay)),
+                       (f"renderer {args.fps:g} fps", lambda: framed(tokens, delay, args.fps, False)),
+                       (f"renderer {args.fps:g} fps + markdown", lambda: framed(tokens, delay, args.fps, True))):
+        sink, busy = run()
+        print(f"  {label:<28} {sink.writes:>6} writes  {busy * 1000:8.2f} ms on the streaming thread")
+
+
+if __name__ == "__main__":
+    main()
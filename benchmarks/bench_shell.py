@@ -0,0 +1,49 @@
+"""
+Compares per-command latency of spawning a new shell for every command against the persistent shell session.
+
+    python benchmarks/bench_shell.py [runs]
+"""
+
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import executor
+import shellsession
+
+COMMAND = 'echo codriver'
+
+
+def measure(run, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = run(COMMAND)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert result.stdout.strip() == 'codriver', result
+    return timings
+
+
+def report(name, timings):
+    ordered = sorted(timings)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"{name:<12} mean {statistics.mean(timings):8.2f} ms   p50 {statistics.median(timings):8.2f} ms   p95 {p95:8.2f} ms")
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    spawn = measure(lambda cmd: executor.run(cmd, echo=False), runs)
+    session = shellsession.ShellSession()
+    persistent = measure(lambda cmd: session.run(cmd, echo=False), runs)
+    session.close()
+    print(f"{runs} runs of `{COMMAND}`")
+    report('spawn', spawn)
+    report('persistent', persistent)
+    print(f"speedup      {statistics.median(spawn) / statistics.median(persistent):.1f}x (p50)")
+
+
+if __name__ == "__main__":
+    main()
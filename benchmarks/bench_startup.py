@@ -0,0 +1,72 @@
+"""
+Measures Codriver's cold start: wall time to import codriver in a fresh interpreter and,
+from python -X importtime, which modules that time goes to.
+Flags heavy modules (the model SDK, tiktoken) that should only load on first use.
+
+    python benchmarks/bench_startup.py [--runs 5] [--top 15]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that should not be imported before the first AI turn.
+DEFERRED = ('openai', 'httpx', 'tiktoken', 'pydantic')
+
+
+def import_times():
+    """Runs python -X importtime -c 'import codriver' and returns {module: (self_us, cumulative_us)}."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import codriver'], cwd=ROOT,
+                            env=dict(os.environ, OPEN_AI_KEY=os.environ.get('OPEN_AI_KEY') or 'startup-bench'),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def wall_times(runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import codriver'], cwd=ROOT, check=True,
+                       env=dict(os.environ, OPEN_AI_KEY=os.environ.get('OPEN_AI_KEY') or 'startup-bench'),
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help="fresh interpreters to time")
+    parser.add_argument('--top', type=int, default=15, help="top-level imports to list")
+    args = parser.parse_args()
+
+    timings = wall_times(args.runs)
+    print(f"import codriver (wall, incl. interpreter)  p50 {statistics.median(timings) * 1000:7.1f} ms"
+          f"   min {min(timings) * 1000:7.1f} ms")
+
+    modules = import_times()
+    total = modules.get('codriver', (0, 0))[1]
+    print(f"import codriver (-X importtime)             {total / 1000:7.1f} ms")
+    print(f"\nslowest imports by cumulative time (top {args.top}):")
+    for name, (self_us, cumulative_us) in sorted(modules.items(), key=lambda item: -item[1][1])[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {self_us / 1000:7.1f} ms self  {name}")
+
+    eager = sorted({name.split('.')[0] for name in modules} & set(DEFERRED))
+    if eager:
+        print(f"\nimported at startup but meant to be deferred: {', '.join(eager)}")
+    else:
+        print("\nno deferred modules imported at startup")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+A local stand-in for an OpenAI-compatible server, for benchmarking Codriver without real API calls.
+Serves /v1/chat/completions (streaming and not) and /v1/models with configurable latency,
+token rate and chunk sizes, answers classifier requests from a script and reports cached prompt tokens
+for the prefix a request shares with recent ones, like a provider-side prompt cache.
+
+    python benchmarks/fake_openai_server.py --port 1234 --latency 0.2 --token-rate 100
+
+Then point Codriver at it with lmstudioIP=127.0.0.1, lmstudioPort=1234 and classifyingModel=lmstudio.
+"""
+
+import argparse
+import array
+import collections
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeConfig:
+    """How the fake server behaves. Times are in seconds."""
+
+    def __init__(self, latency=0.0, token_rate=0.0, chunk_tokens=1, answer_tokens=50,
+                 classifications=None, default_intent='QUERY', command='echo codriver-fake-command', max_concurrent=0):
+        self.latency = latency
+        # Tokens per second while streaming, 0 means as fast as possible.
+        self.token_rate = token_rate
+        self.chunk_tokens = max(1, chunk_tokens)
+        self.answer_tokens = answer_tokens
+        # Input text -> QUERY / COMMAND / SHELL for classifier requests.
+        self.classifications = classifications or {}
+        self.default_intent = default_intent
+        self.command = command
+        # Requests served at once before answering 429 with Retry-After, 0 for no limit.
+        self.max_concurrent = max_concurrent
+        # Recent prompts as (message hashes, cumulative tokens) arrays, to report cached_tokens like a provider's prompt cache would.
+        self.prompts = collections.deque(maxlen=4)
+        self.requests = 0
+        self.rate_limited = 0
+        self.active = 0
+        self.lock = threading.Lock()
+
+
+def _common_prefix(prompt, earlier):
+    """Tokens in the leading messages two prompts have in common."""
+    (hashes, totals), (other, _) = prompt, earlier
+    shared = 0
+    for a, b in zip(hashes, other):
+        if a != b:
+            break
+        shared += 1
+    return totals[shared - 1] if shared else 0
+
+
+def _last_user_content(messages):
+    for message in reversed(messages):
+        if message.get('role') == 'user':
+            return message.get('content') or ''
+    return ''
+
+
+def reply_for(config, messages):
+    """Picks the reply text for a request: an intent, a command, or a generated answer."""
+    system = messages[0].get('content', '') if messages else ''
+    user = _last_user_content(messages)
+    if 'command classifier' in system:
+        text = user.split('User input:', 1)[-1].strip()
+        return config.classifications.get(text, config.default_intent)
+    if user.startswith('Command request:') or 'run a command' in user or 'Reply ONLY with the command' in user:
+        return config.command
+    return " ".join(f"token{i}" for i in range(config.answer_tokens))
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/v1/models':
+            self._send_json({"object": "list", "data": [{"id": "fake", "object": "model", "owned_by": "codriver"}]})
+        else:
+            self._send_json({"error": {"message": "not found"}}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        request = json.loads(self.rfile.read(length) or b'{}')
+        if self.path.rstrip('/') != '/v1/chat/completions':
+            self._send_json({"error": {"message": "not found"}}, status=404)
+            return
+        config = self.config
+        with config.lock:
+            config.requests += 1
+            limited = bool(config.max_concurrent) and config.active >= config.max_concurrent
+            if limited:
+                config.rate_limited += 1
+            else:
+                config.active += 1
+        if limited:
+            body = json.dumps({"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}).encode('utf-8')
+            self.send_response(429)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Retry-After', '0.2')
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        try:
+            self._complete(request, config)
+        finally:
+            with config.lock:
+                config.active -= 1
+
+    def _complete(self, request, config):
+        messages = request.get('messages', [])
+        model = request.get('model', 'fake')
+        text = reply_for(config, messages)
+        hashes = array.array('q', (hash((m.get('role'), m.get('content'))) for m in messages))
+        totals = array.array('q', itertools.accumulate(len((m.get('content') or '').split()) for m in messages))
+        prompt = (hashes, totals)
+        prompt_tokens = totals[-1] if totals else 0
+        with config.lock:
+            cached = max((_common_prefix(prompt, earlier) for earlier in config.prompts), default=0)
+            config.prompts.append(prompt)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(text.split()),
+                 "total_tokens": prompt_tokens + len(text.split()),
+                 "prompt_tokens_details": {"cached_tokens": cached}}
+        if config.latency:
+            time.sleep(config.latency)
+        if not request.get('stream'):
+            self._send_json({
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        words = text.split(' ')
+        pieces = [" ".join(words[i:i + config.chunk_tokens]) + " " for i in range(0, len(words), config.chunk_tokens)]
+        for piece in pieces:
+            chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                     "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            if config.token_rate:
+                time.sleep(config.chunk_tokens / config.token_rate)
+        final = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        if (request.get('stream_options') or {}).get('include_usage'):
+            final["usage"] = usage
+        self._write_chunk(f"data: {json.dumps(final)}\n\n".encode('utf-8'))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+
+def start_server(config, host='127.0.0.1', port=0):
+    """Starts the fake server in a daemon thread. Returns (server, port)."""
+    handler = type('ConfiguredHandler', (Handler,), {'config': config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.server_address[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible server for Codriver benchmarks.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1234)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds before the first byte of each response")
+    parser.add_argument('--token-rate', type=float, default=0.0, help="streamed tokens per second, 0 for unlimited")
+    parser.add_argument('--chunk-tokens', type=int, default=1, help="tokens per streamed chunk")
+    parser.add_argument('--answer-tokens', type=int, default=50, help="tokens in each generated answer")
+    parser.add_argument('--script', help="JSON file mapping inputs to QUERY, COMMAND or SHELL for classifier requests")
+    parser.add_argument('--default-intent', default='QUERY')
+    parser.add_argument('--max-concurrent', type=int, default=0, help="answer 429 beyond this many requests at once")
+    args = parser.parse_args()
+    classifications = {}
+    if args.script:
+        with open(args.script, 'r', encoding='utf-8') as f:
+            classifications = json.load(f)
+    config = FakeConfig(args.latency, args.token_rate, args.chunk_tokens, args.answer_tokens,
+                        classifications, args.default_intent, max_concurrent=args.max_concurrent)
+    server, port = start_server(config, args.host, args.port)
+    print(f"Fake OpenAI server on http://{args.host}:{port}/v1 (Ctrl-C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+This module keeps an on-disk cache of classified intents and generated commands,
+so repeated inputs are answered without calling the model again.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Start an input with this to skip the cached entry for it, replacing it with the fresh answer.
+bypassPrefix = os.environ.get('cacheBypassPrefix') or '!'
+cacheMaxEntries = int(os.environ.get('cacheMaxEntries') or 5000)
+cacheTTL = float(os.environ.get('cacheTTLDays') or 30) * 86400
+
+# Words that make a request depend on the turns before it ("now do the same for the other folder").
+context_reference = re.compile(
+    r"\b(same|again|other|another|previous|last|that|those|these|them|it|its|instead|too|also)\b", re.IGNORECASE)
+
+hits = 0
+_conn = None
+_lock = threading.Lock()
+
+
+def config_dir():
+    """Returns the per-user Codriver config directory, creating it if needed."""
+    if os.name == 'nt':
+        base = os.environ.get('APPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser('~/.config')
+    path = os.path.join(base, 'codriver')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _connect():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(os.path.join(config_dir(), 'cache.db'), check_same_thread=False)
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                intent TEXT NOT NULL,
+                command TEXT,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        _conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used)")
+        _conn.commit()
+    return _conn
+
+
+def normalize(text, keep_case=False):
+    """Collapses whitespace, and case unless keep_case is set, so trivially different inputs share an entry."""
+    text = " ".join(text.split())
+    return text if keep_case else text.lower()
+
+
+def make_key(kind, text, os_type, model):
+    """
+    Builds a key for an 'intent' or 'command' entry from the normalized input, OS type and model.
+    Command keys keep the case, since 'delete the folder Build' and '... build' are different commands.
+    """
+    return f"{kind}\x1f{os_type}\x1f{model}\x1f{normalize(text, keep_case=kind == 'command')}"
+
+
+def refers_to_context(text):
+    """True if text leans on earlier turns, so a command generated for it can't be reused elsewhere."""
+    return context_reference.search(text) is not None
+
+
+def split_bypass(command):
+    """Returns (command, bypass) with the bypass prefix removed if it was present."""
+    stripped = command.lstrip()
+    if bypassPrefix and stripped.startswith(bypassPrefix):
+        return stripped[len(bypassPrefix):].lstrip(), True
+    return command, False
+
+
+def lookup(key):
+    """Returns (intent, command) for a live entry, or None."""
+    global hits
+    now = time.time()
+    try:
+        with _lock:
+            conn = _connect()
+            row = conn.execute("SELECT intent, command, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[2] > cacheTTL:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (now, key))
+            conn.commit()
+    except sqlite3.Error:
+        return None
+    hits += 1
+    return row[0], row[1]
+
+
+def store(key, intent, command=None):
+    """Saves an intent (and the generated command for COMMAND intents), evicting the least recently used entries."""
+    now = time.time()
+    try:
+        with _lock:
+            conn = _connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, intent, command, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, intent, command, now, now),
+            )
+            conn.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (cacheMaxEntries,),
+            )
+            conn.commit()
+    except sqlite3.Error:
+        pass
+
+
+def forget(key):
+    """Removes one entry, e.g. a cached command the user turned down."""
+    try:
+        with _lock:
+            conn = _connect()
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            conn.commit()
+    except sqlite3.Error:
+        pass
+
+
+def clear():
+    """Removes every cached entry."""
+    with _lock:
+        conn = _connect()
+        conn.execute("DELETE FROM entries")
+        conn.commit()
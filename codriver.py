@@ -2,46 +2,30 @@
 This is the main application file for Codriver.
 """
 
-import time
+import argparse
+import contextlib
 import os
-import socket
 import subprocess
-from dotenv import load_dotenv
-from openai import OpenAI
+import threading
 from prompt_toolkit import PromptSession
-from prompt_toolkit.completion import PathCompleter, Completer, Completion
-from prompt_toolkit.document import Document
-from prompt_toolkit.key_binding.defaults import load_key_bindings as default_key_bindings
-
-class CustomShellPathCompleter(Completer):
-    def __init__(self):
-        self.path_completer = PathCompleter()
-
-    def get_completions(self, document: Document, complete_event):
-        word_before_cursor = document.get_word_before_cursor(WORD=True)
-
-        # Get all possible completions from the PathCompleter by providing it with an empty document.
-        temp_document = Document('', 0)
-        all_completions = self.path_completer.get_completions(temp_document, complete_event)
-
-        # Then, we manually filter these completions based on the word before the cursor.
-        # For each match, we create a new Completion object with a corrected start_position.
-        # This tells prompt_toolkit to replace the word being typed.
-        for completion in all_completions:
-            if completion.text.lower().startswith(word_before_cursor.lower()):
-                yield Completion(
-                    completion.text,
-                    start_position=-len(word_before_cursor),
-                    display=completion.display,
-                    display_meta=completion.display_meta
-                )
-
+from prompt_toolkit.filters import Condition
+from prompt_toolkit.key_binding import KeyBindings
+from prompt_toolkit.patch_stdout import patch_stdout
 from prompt_toolkit.styles import Style
 
 
 import modellogic as modellogic
-
-load_dotenv()
+import intent
+import cache
+import conversation
+import executor
+import shellsession
+import retrieval
+import profiling
+import settings
+import jobs
+import watch
+from completion import ShellCompleter
 
 # System prompts
 windows_prompt = {
@@ -89,36 +73,45 @@ if os_type == 'windows':
     except ImportError:
         pass
 
-defaultIdentity = linux_prompt if os_type == 'linux' else windows_prompt
-history = [defaultIdentity]
+defaultIdentity = modellogic.system_prompt(linux_prompt if os_type == 'linux' else windows_prompt)
+history = conversation.ConversationHistory(defaultIdentity)
 classifyingModel = os.environ.get('classifyingModel')
+# Start answering natural-language input while it is still being classified.
+speculativeQuery = settings.flag('speculativeQuery')
+# Stream answers in the background so the next input can be typed while they arrive.
+backgroundAnswers = settings.flag('backgroundAnswers', True)
+
+# Seconds a cancelled answer gets to wind down before the prompt stops waiting for it.
+CANCEL_WAIT_SECONDS = 1.0
+# (thread, modellogic.Cancellation) of the answer streaming right now, if any.
+answer_task = None
+# The turn of the last answer, finished when the answer was, until the status line reports it.
+answered_turn = None
 
 # Welcome banner
 banner = f"""
 \033[94mCodriver\x1b[0m is now online.
 \x1b[90m🤖 Codriver decides your intent automatically.
 💬 Type a shell command directly, ask the ai a question, or ask the ai to run a command for you.
+✋ Ctrl-C or Esc stops an answer mid-stream, keeping what arrived. You can type the next input while it streams.
 ⌨️ Pipe your command along with a '?' to ai to ask it about the output. eg. 'dir |? how many files are in here?'
-🗃️ Add file(s) to your conversation context with @, eg. '@mycode.ps1 @mynotes.txt' 
+🗃️ Add file(s), folders or globs to your conversation context with @, eg. '@mycode.ps1 @src/ @docs/*.md' 
 💾 Save the last AI response with save, eg. 'save mycode.py'
-🔁 gpt-4.1 or llm -- Model selection
+🔁 gpt-4.1, llm or auto -- Model selection, auto routes to the fastest healthy backend
 ⬅️ reset - Resets conversation history.
+👀 Watch a stream with |?~, eg. 'tail -f app.log |?~ alert me on errors'
+⏳ Run long commands in the background with a trailing & or bg, then jobs, fg %1, kill %1, or ask about one with '%1 |? why did it fail'
+📊 stats -- Latency per stage and per backend for this session
 👋 exit -- Quit
 """
 
 def clear_screen():
-    os.system('cls' if os_type == 'windows' else 'clear')
+    # Clear and home the cursor with ANSI codes instead of spawning cls/clear.
+    print("\033[2J\033[H", end='', flush=True)
 
 def reset_convo_history():
-    global history
-    history = [defaultIdentity]
-
-def is_port_listening(ip_address, port):
-    try:
-        with socket.create_connection((ip_address, port), timeout=1):
-            return True
-    except (ConnectionRefusedError, socket.timeout):
-        return False
+    history.reset()
+    retrieval.clear()
 
 current_directory = os.getcwd()
 
@@ -150,59 +143,367 @@ def run_powershell_command(command, directory):
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
 
-def run_and_capture(cmd):
+def sync_directory(directory):
+    """Follows the persistent shell into the directory it ended up in."""
+    global current_directory
+    if directory and directory != current_directory and os.path.isdir(directory):
+        os.chdir(directory)
+        current_directory = os.getcwd()
+
+def run_and_capture(cmd, echo=False):
     """
     Execute a shell command and capture stdout, stderr, and return code.
-    Handles Windows (PowerShell) vs Linux shells and enforces a timeout.
+    Output is streamed live when echo is set, only a bounded head and tail is kept.
     Returns a subprocess.CompletedProcess instance.
     """
-    if os_type == 'windows':
-        args = ["powershell", "-ExecutionPolicy", "Bypass", "-Command", cmd]
-        shell = False
-    else:
-        args = cmd
-        shell = True
-    proc = subprocess.Popen(
-        args,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-        shell=shell,
-    )
-    try:
-        stdout, stderr = proc.communicate(timeout=30)
-    except subprocess.TimeoutExpired:
-        proc.kill()
-        stdout, stderr = proc.communicate()
-        stderr += "\nError: Command timed out after 30 seconds."
-    return subprocess.CompletedProcess(proc.args, proc.returncode, stdout, stderr)
+    if shellsession.persistentShell:
+        result = shellsession.get_session(current_directory).run(cmd, echo=echo)
+        sync_directory(result.cwd)
+        return result
+    return executor.run(cmd, echo=echo)
 
 def execute_and_record(command):
     """
-    Run a command using run_and_capture, print its output,
+    Run a command using run_and_capture, streaming its output,
     and store both stdout and stderr in the conversation history.
     Returns the CompletedProcess result.
     """
-    result = run_and_capture(command)
-    if result.stdout.strip():
-        print(result.stdout.rstrip())
-        history.append({"role": "assistant", "content": f"Command output:\n{result.stdout}"})
-    if result.stderr.strip():
-        print(f"\x1b[91mError:\n{result.stderr}\x1b[0m")
-        history.append({"role": "assistant", "content": f"Command error:\n{result.stderr}"})
+    result = run_and_capture(command, echo=True)
+    history.add_output(result.stdout, result.stderr)
     return result
 
-def main():
+def answer(stream):
+    """
+    Runs stream(cancel), which writes an answer, on its own thread. With backgroundAnswers the prompt
+    comes back right away; otherwise this waits for it, and Ctrl-C cancels just the answer either way.
+    The turn ends when the answer does, so time spent typing the next input isn't counted in it.
+    """
+    global answer_task
+    cancel = modellogic.Cancellation()
+    turn = profiling.current()
+
+    def target():
+        global answered_turn
+        try:
+            stream(cancel)
+        except Exception as e:
+            print(f"\x1b[91mError: {e}\x1b[0m")
+        finished = profiling.end_turn(turn) if turn else None
+        if backgroundAnswers:
+            # The prompt is already back, so this is the next prompt's status line.
+            if finished and profiling.summary(finished):
+                print(f"\x1b[90mLast turn: {profiling.summary(finished)}\x1b[0m")
+        else:
+            answered_turn = finished
+
+    thread = threading.Thread(target=target, daemon=True)
+    answer_task = (thread, cancel)
+    thread.start()
+    if not backgroundAnswers:
+        wait_for_answer()
+
+def answer_running():
+    return answer_task is not None and answer_task[0].is_alive()
+
+def wait_for_answer(cancel=False):
+    """Lets the answer still streaming finish before the next input is handled, or cancels it."""
+    global answer_task
+    if answer_task is None:
+        return
+    thread, cancellation = answer_task
+    if cancel:
+        cancellation.cancel()
+    try:
+        while thread.is_alive() and not cancellation.is_set():
+            thread.join(0.1)
+    except KeyboardInterrupt:
+        cancellation.cancel()
+    # A cancelled request still waiting on the server is left to finish on its own, it won't touch history.
+    thread.join(CANCEL_WAIT_SECONDS)
+    answer_task = None
+
+def attached_context(question):
+    """
+    Pins small @-attached files whole after the system prompt, and returns the excerpts of larger ones
+    relevant to question, to send with this turn only.
+    """
+    try:
+        retrieval.refresh()
+        history.pin(retrieval.pinned_messages())
+        return retrieval.context_messages(question)
+    except Exception as e:
+        print(f"\x1b[91mError reading attached files: {e}\x1b[0m")
+        return []
+
+def dispatch_intent(user_intent, command, bypass_cache=True):
+    """
+    Acts on a classified intent: answer a QUERY, generate and confirm a COMMAND,
+    or pass a SHELL command straight through.
+    Generated commands are reused from the cache unless bypass_cache is set, then the accepted one replaces it.
+    A cached command the user turns down is dropped from the cache.
+    """
+    if user_intent == 'QUERY':
+        context = attached_context(command)
+        answer(lambda cancel: modellogic.stream_openai(command, history, context, cancel=cancel))
+    elif user_intent == 'COMMAND':
+        # "do the same for the other folder" means something else in every conversation.
+        cacheable = not cache.refers_to_context(command)
+        command_key = cache.make_key('command', command, os_type, modellogic.get_model())
+        cached = cache.lookup(command_key) if cacheable and not bypass_cache else None
+        if cached and cached[1]:
+            ai_response = cached[1]
+            print("\x1b[90m(cached command)\x1b[0m")
+            history.append(modellogic.command_request(command))
+            history.append({"role": "assistant", "content": ai_response})
+        else:
+            ai_response = modellogic.command_openai(command, history, attached_context(command))
+        confirmation = input(f"\n\033[94mCodriver:\033[0m Run `{ai_response}`? (Y/n) ")
+        if confirmation.lower() in ('y','', 'yes'):
+            # Only commands the user accepted are worth remembering.
+            if cacheable:
+                cache.store(command_key, 'COMMAND', ai_response)
+            print(f"\n\x1b[90mRunning {ai_response}\x1b[0m")
+            # Use the unified execution helper to capture output and errors
+            execute_and_record(ai_response)
+        elif cached:
+            cache.forget(command_key)
+    elif user_intent == 'SHELL':
+        execute_and_record(command)
+    else:
+        print("\x1b[91mUnknown intent, defaulting to SHELL.\x1b[0m")
+        execute_and_record(command)
+
+def handle_command(command):
+    """
+    Handles one line of user input: builtins, |? pipes, @ attachments, save, and
+    everything else by intent. Returns False when the user asked to exit.
+    """
     global current_directory
+    command, bypass_cache = cache.split_bypass(command)
+    # Input typed while an answer streamed waits for it, so history stays in order.
+    if answer_task is not None:
+        wait_for_answer(cancel=command.lower() in ('exit', 'quit', 'reset'))
+    profiling.start_turn(command)
+    if command.lower() in ['exit', 'quit']:
+        running = [job for job in jobs.all_jobs() if job.running]
+        if running:
+            print(f"\x1b[90mStopping {len(running)} background job(s).\x1b[0m")
+        print("\033[94mCodriver\033[0m: See you next time.")
+        return False
+
+    elif command == 'stats':
+        print(f"\x1b[90m{profiling.stats_table()}\n\n{modellogic.router_table()}\x1b[0m")
+
+    elif command == 'jobs':
+        listed = jobs.all_jobs()
+        print("\n".join(job.describe() for job in listed) if listed else "\x1b[90mNo jobs.\x1b[0m")
+
+    elif command.split()[:1] == ['fg'] and len(command.split()) <= 2:
+        job = jobs.get(command.split()[1] if len(command.split()) == 2 else None)
+        if job is None:
+            print("\x1b[91mNo such job.\x1b[0m")
+            return True
+        print(f"\x1b[90m{job.describe()}\x1b[0m")
+        job.attach()
+        history.add_output(*job.output())
+        print(f"\x1b[90m{job.describe()}\x1b[0m")
+
+    elif command.startswith('kill %'):
+        job = jobs.get(command[len('kill'):])
+        if job is None:
+            print("\x1b[91mNo such job.\x1b[0m")
+        elif not job.running:
+            print(f"\x1b[90m{job.describe()}\x1b[0m")
+        else:
+            job.kill()
+            print(f"\x1b[90m[{job.number}] Killed  {job.command}\x1b[0m")
+
+    # Long commands run as background jobs, with a trailing & or bg. Always a new process, even with persistentShell.
+    elif command.startswith('bg ') or jobs.is_background(command):
+        job_command = command[len('bg '):].strip() if command.startswith('bg ') else command.rstrip()[:-1].rstrip()
+        job = jobs.start(job_command, cwd=current_directory)
+        print(f"\x1b[90m[{job.number}] {job.proc.pid}  {job.command}\x1b[0m")
+
+    # Watch mode: stream the output and only send new, interesting lines to the model now and then.
+    elif '|?~' in command:
+        real_command, _, instruction = (part.strip() for part in command.partition('|?~'))
+        if not real_command or not instruction:
+            print("\x1b[91mInvalid format. Both a command and an instruction are required.\x1b[0m")
+            return True
+        summary = watch.run(real_command, instruction, cwd=current_directory)
+        if summary:
+            history.append({"role": "assistant", "content": f"Summary of watching `{real_command}` ({instruction}):\n{summary}"})
+            print(f"\n\x1b[90mSummary: {summary}\x1b[0m")
+
+    elif '|?' in command:
+        try:
+            separator_pos = command.find('|?')
+            real_command = command[:separator_pos].strip()
+            ai_prompt = command[separator_pos + 2:].strip()
+            if not real_command or not ai_prompt:
+                print("\x1b[91mInvalid format. Both a command and a prompt are required.\x1b[0m")
+                return True
+            def run_and_capture_inner(cmd):
+                return run_and_capture(cmd)
+            # '%1 |? ...' asks about a background job's output instead of running anything.
+            job = None
+            if jobs.job_reference.match(real_command):
+                job = jobs.get(real_command)
+                if job is None:
+                    print("\x1b[91mNo such job.\x1b[0m")
+                    return True
+                stdout, stderr = job.output()
+                result = subprocess.CompletedProcess(job.command, job.proc.returncode, stdout, stderr)
+                real_command = job.command
+                print(f"\x1b[90mPiping the output of job [{job.number}] '{real_command}' to AI...\x1b[0m")
+            else:
+                print(f"\x1b[90mRunning '{real_command}' and piping output to AI...\x1b[0m")
+                os.chdir(current_directory)
+                result = run_and_capture_inner(real_command)
+            history.add_output(result.stdout, result.stderr)
+            if result.returncode != 0 and job is None:
+                error_message = result.stderr if result.stderr else result.stdout
+                print(f"\x1b[91mError executing command:\n{error_message}\x1b[0m")
+                error_fixing_prompt = f"""The user's command `{real_command}` failed with the error:
+{error_message}
+Provide a corrected command. Reply ONLY with the command."""
+                print("\x1b[90mCalling AI for a suggested fix...\x1b[0m")
+                suggested_command = modellogic.command_openai(error_fixing_prompt, history)
+                if not suggested_command or not suggested_command.strip():
+                    print("\x1b[91mCodriver: No suggestion from AI.\x1b[0m")
+                    return True
+                confirmation = input(f"\n\033[94mCodriver:\033[0m Run corrected command `{suggested_command}`? (Y/n) ")
+                if confirmation.lower() == 'y':
+                    real_command = suggested_command
+                    result = run_and_capture_inner(real_command)
+                    history.add_output(result.stdout, result.stderr)
+            # The output is already in history, so the prompt only refers to it instead of sending it twice.
+            full_ai_prompt = modellogic.pipe_prompt(real_command, ai_prompt, bool(result.stdout.strip() or result.stderr.strip()))
+            context = attached_context(ai_prompt)
+            answer(lambda cancel: modellogic.stream_openai(full_ai_prompt, history, context, cancel=cancel))
+        except Exception as e:
+            print(f"Error in pipe-to-AI block: {e}")
+
+    elif command == 'gpt-4.1':
+        modellogic.use_backend('openai', "gpt-4.1")
+        print(f"\x1b[90mModel set to {modellogic.get_model()}.\x1b[0m")
+
+    elif command == 'llm':
+        if modellogic.use_backend('lmstudio'):
+            print(f"\x1b[90mModel set to {modellogic.get_model()}.\x1b[0m")
+        else:
+            print("\x1b[90mLLM not online.\x1b[0m")
+
+    elif command == 'auto':
+        modellogic.set_auto_route(True)
+        print(f"\x1b[90mRouting each request to the fastest healthy backend, currently {modellogic.ranked()[0].name}.\x1b[0m")
+
+    elif command == 'reset':
+        reset_convo_history()
+        clear_screen()
+        print(banner)
+        print("\n\033[94mCodriver:\033[0m OK. Let's start fresh.")
+
+    # The persistent shell tracks its own directory, cd and drive changes just run there.
+    elif command.endswith(':') and len(command) == 2 and not shellsession.persistentShell:
+        os.system(command)
+        current_directory = command + os.sep
+
+    elif command.startswith('cd') and not shellsession.persistentShell:
+        handle_cd_command(command)
+
+    elif command.split() and command.split()[0].lower() in ['ls', 'dir']:
+        result = run_and_capture(command, echo=True)
+        history.add_output(result.stdout, result.stderr)
+
+    elif command.strip().startswith('@'):
+        patterns = [word.lstrip('@') for word in command.split() if word.startswith('@')]
+        try:
+            count, indexed = retrieval.attach(patterns, current_directory)
+            if count:
+                print(f"\x1b[90mAttached {count} file(s) to context ({indexed} indexed, {count - indexed} unchanged). Relevant parts are sent with each question.\x1b[0m")
+        except Exception as e:
+            print(f"\x1b[91mError attaching files: {e}\x1b[0m")
+
+    elif command.startswith('save '):
+        filename = command[5:].strip()
+        if not filename:
+            print("\x1b[91mUsage: save <filename>\x1b[0m")
+            return True
+        last_response = None
+        for msg in reversed(history):
+            if msg.get('role') == 'assistant':
+                last_response = msg.get('content')
+                break
+        if last_response:
+            try:
+                absolute_path = os.path.abspath(os.path.join(current_directory, filename))
+                with open(absolute_path, 'w', encoding='utf-8') as f:
+                    f.write(last_response)
+                print(f"\x1b[90mSaved to '{filename}'.\x1b[0m")
+            except Exception as e:
+                print(f"\x1b[91Error saving file: {e}\x1b[0m")
+        else:
+            print("\x1b[91No assistant response to save.\x1b[0m")
+
+    else:
+        # Obvious shell commands and questions are settled locally, only ambiguous input reaches the classifier.
+        user_intent = intent.fast_classify(command)
+        if user_intent:
+            dispatch_intent(user_intent, command)
+            return True
+        model_choice = (os.environ.get('classifyingModel') or classifyingModel or "gpt-4.1-nano").strip()
+        intent_key = cache.make_key('intent', command, os_type, model_choice)
+        cached = None if bypass_cache else cache.lookup(intent_key)
+        if cached:
+            user_intent = cached[0]
+            print(f"\x1b[90m(cached intent: {user_intent})\x1b[0m")
+        else:
+            speculative = None
+            if speculativeQuery and intent.looks_like_natural_language(command):
+                speculative = modellogic.SpeculativeQuery(command, history, attached_context(command))
+            try:
+                user_intent = modellogic.classify(command, model_choice)
+                # With the bypass prefix this replaces the cached intent.
+                if user_intent in ('QUERY', 'COMMAND', 'SHELL'):
+                    cache.store(intent_key, user_intent)
+            except Exception as e:
+                print(f"\x1b[91mClassification error: {e}\x1b[0m")
+                user_intent = "SHELL"
+            if speculative is not None:
+                if user_intent == 'QUERY':
+                    def commit(cancel):
+                        saved = speculative.commit(history, cancel)
+                        if not cancel.is_set():
+                            print(f"\x1b[90m(speculative answer: {saved:.2f}s saved to first token)\x1b[0m")
+                    answer(commit)
+                    return True
+                speculative.cancel()
+        dispatch_intent(user_intent, command, bypass_cache)
+    return True
+
+def main():
+    global answered_turn
     clear_screen()
     print(banner)
 
-    path_completer = CustomShellPathCompleter()
+    path_completer = ShellCompleter()
     style = Style.from_dict({
         'directory': 'ansigray',
         'prompt': 'ansicyan',
     })
-    session = PromptSession(completer=path_completer, style=style)
+    # While an answer streams, Ctrl-C and Esc at the prompt cancel it instead of leaving Codriver.
+    bindings = KeyBindings()
+    streaming = Condition(answer_running)
+
+    @bindings.add('c-c', filter=streaming)
+    @bindings.add('escape', filter=streaming, eager=True)
+    def _(event):
+        answer_task[1].cancel()
+
+    session = PromptSession(completer=path_completer, style=style, complete_in_thread=True, key_bindings=bindings)
+    intent.build_index()
+    modellogic.warm_up()
     
     while True:
         try:
@@ -211,205 +512,54 @@ def main():
                 ('class:directory', f"\n{current_directory}"),
                 ('class:prompt', f"{prompt_char} "),
             ]
-            print(f"\n\x1b[90mMain Model: {modellogic.get_model()} -- Intent Model: {classifyingModel}\x1b[0m")
-            command = session.prompt(prompt_message)
+            status = f"Main Model: {modellogic.get_model()} -- Intent Model: {classifyingModel} -- Local intent: {intent.fast_path_hits} calls saved -- Cache hits: {cache.hits}"
+            if history.last_request:
+                sent = history.last_request
+                status += f" -- Last prompt: {sent['tokens']}/{sent['budget']} tokens, {sent['messages']} msgs"
+                if 'cached' in sent:
+                    status += f", {sent['cached']} cached"
+                if sent['compacted']:
+                    status += f", {sent['compacted']} compacted"
+            for job in jobs.take_notifications():
+                print(f"\n\x1b[90m{job.describe()}\x1b[0m", end='')
+            # An answer streaming in the background reports its turn itself when it finishes.
+            if not answer_running():
+                last_turn, answered_turn = profiling.end_turn() or answered_turn, None
+                if last_turn and profiling.summary(last_turn):
+                    status += f" -- Last turn: {profiling.summary(last_turn)}"
+                print(f"\n\x1b[90m{status}\x1b[0m")
+            # The answer's output goes above the prompt instead of through what's being typed.
+            with patch_stdout(raw=True) if answer_running() else contextlib.nullcontext():
+                command = session.prompt(prompt_message)
         except (EOFError, KeyboardInterrupt):
+            wait_for_answer(cancel=True)
             print("\n\033[94mCodriver\033[0m: See you next time.")
             break
 
         if not command.strip():
             continue
-        if command.lower() in ['exit', 'quit']:
-            print("\033[94mCodriver\033[0m: See you next time.")
+        if not handle_command(command):
             break
 
-        elif '|?' in command:
-            try:
-                separator_pos = command.find('|?')
-                real_command = command[:separator_pos].strip()
-                ai_prompt = command[separator_pos + 2:].strip()
-                if not real_command or not ai_prompt:
-                    print("\x1b[91mInvalid format. Both a command and a prompt are required.\x1b[0m")
-                    continue
-                def run_and_capture_inner(cmd):
-                    return run_and_capture(cmd)
-                print(f"\x1b[90mRunning '{real_command}' and piping output to AI...\x1b[0m")
-                os.chdir(current_directory)
-                result = run_and_capture_inner(real_command)
-                if result.stdout.strip():
-                    history.append({"role": "assistant", "content": f"Command output:\n{result.stdout}"})
-                if result.stderr.strip():
-                    history.append({"role": "assistant", "content": f"Command error:\n{result.stderr}"})
-                if result.returncode != 0:
-                    error_message = result.stderr if result.stderr else result.stdout
-                    print(f"\x1b[91mError executing command:\n{error_message}\x1b[0m")
-                    error_fixing_prompt = f"""The user's command `{real_command}` failed with the error:
-{error_message}
-Provide a corrected command. Reply ONLY with the command."""
-                    print("\x1b[90mCalling AI for a suggested fix...\x1b[0m")
-                    suggested_command = modellogic.command_openai(error_fixing_prompt, history)
-                    if not suggested_command or not suggested_command.strip():
-                        print("\x1b[91mCodriver: No suggestion from AI.\x1b[0m")
-                        continue
-                    confirmation = input(f"\n\033[94mCodriver:\033[0m Run corrected command `{suggested_command}`? (Y/n) ")
-                    if confirmation.lower() == 'y':
-                        real_command = suggested_command
-                        result = run_and_capture_inner(real_command)
-                        if result.stdout.strip():
-                            history.append({"role": "assistant", "content": f"Command output:\n{result.stdout}"})
-                        if result.stderr.strip():
-                            history.append({"role": "assistant", "content": f"Command error:\n{result.stderr}"})
-                full_ai_prompt = f"""The user ran the command: `{real_command}`
-Output:
----
-{result.stdout}
----
-Question: "{ai_prompt}"
-"""
-                modellogic.stream_openai(full_ai_prompt, history)
-                modellogic.stream_openai(full_ai_prompt, history)
-            except Exception as e:
-                print(f"Error in pipe-to-AI block: {e}")
-
-        elif command == 'gpt-4.1':
-            modellogic.set_model("gpt-4.1")
-            modellogic.set_client(OpenAI(api_key=os.environ.get('OPEN_AI_KEY')))
-            print(f"\x1b[90mModel set to {modellogic.get_model()}.\x1b[0m")
-
-        elif command == 'llm':
-            if is_port_listening(modellogic.lmstudioIP, modellogic.lmstudioPort):
-                modellogic.set_model(modellogic.lmstudioModel)
-                modellogic.set_client(OpenAI(base_url=f"http://{modellogic.lmstudioIP}:{modellogic.lmstudioPort}/v1", api_key="lm-studio"))
-                print(f"\x1b[90mModel set to {modellogic.get_model()}.\x1b[0m")
-            else:
-                print("\x1b[90mLLM not online.\x1b[0m")
-
-        elif command == 'reset':
-            reset_convo_history()
-            clear_screen()
-            print(banner)
-            print("\n\033[94mCodriver:\033[0m OK. Let's start fresh.")
-
-        elif command.endswith(':') and len(command) == 2:
-            os.system(command)
-            current_directory = command + os.sep
-
-        elif command.startswith('cd'):
-            handle_cd_command(command)
-
-        elif command.split() and command.split()[0].lower() in ['ls', 'dir']:
-            def _run_capture(cmd):
-                if os_type == 'windows':
-                    args = ["powershell", "-ExecutionPolicy", "Bypass", "-Command", cmd]
-                    shell = False
-                else:
-                    args = cmd
-                    shell = True
-                proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, shell=shell)
-                try:
-                    out, err = proc.communicate(timeout=20)
-                except subprocess.TimeoutExpired:
-                    proc.kill()
-                    out, err = proc.communicate()
-                    err += "\nError: Command timed out after 20 seconds."
-                return proc.returncode, out, err
-            retcode, out, err = _run_capture(command)
-            if retcode != 0:
-                print(f"\x1b[91mCommand error:\n{err or out}\x1b[0m")
-                # Record error in history
-                if err.strip():
-                    history.append({"role": "assistant", "content": f"Command error:\n{err}"})
-                elif out.strip():
-                    history.append({"role": "assistant", "content": f"Command output (error code):\n{out}"})
-            else:
-                print(out.rstrip())
-                # Record successful output in history
-                if out.strip():
-                    history.append({"role": "assistant", "content": f"Command output:\n{out}"})
-
-        elif command.strip().startswith('@'):
-            filenames = [word.lstrip('@') for word in command.split() if word.startswith('@')]
-            for filename in filenames:
-                absolute_path = os.path.abspath(os.path.join(current_directory, filename))
-                if not os.path.exists(absolute_path):
-                    print(f"\x1b[91mError: File not found at '{absolute_path}'\x1b[0m")
-                    continue
-                try:
-                    if os.path.getsize(absolute_path) > 1 * 1024 * 1024:
-                        print(f"\x1b[91mError: File '{filename}' too large.\x1b[0m")
-                        continue
-                    with open(absolute_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        file_content = f.read()
-                    history.append({
-                        "role": "user",
-                        "content": f"Here is the content of the file '{filename}':\n\n---\n{file_content}\n---"
-                    })
-                    print(f"\x1b[90mAdded '{filename}' to context.\x1b[0m")
-                except Exception as e:
-                    print(f"\x1b[91Error reading file '{filename}': {e}")
-
-        elif command.startswith('save '):
-            filename = command[5:].strip()
-            if not filename:
-                print("\x1b[91mUsage: save <filename>\x1b[0m")
-                continue
-            last_response = None
-            for msg in reversed(history):
-                if msg.get('role') == 'assistant':
-                    last_response = msg.get('content')
-                    break
-            if last_response:
-                try:
-                    absolute_path = os.path.abspath(os.path.join(current_directory, filename))
-                    with open(absolute_path, 'w', encoding='utf-8') as f:
-                        f.write(last_response)
-                    print(f"\x1b[90mSaved to '{filename}'.\x1b[0m")
-                except Exception as e:
-                    print(f"\x1b[91Error saving file: {e}\x1b[0m")
-            else:
-                print("\x1b[91No assistant response to save.\x1b[0m")
-
-        else:
-            # Classification logic unchanged
-            model_choice = (os.environ.get('classifyingModel') or classifyingModel or "gpt-4.1-nano").strip()
-            if model_choice.lower() == "lmstudio":
-                if is_port_listening(modellogic.lmstudioIP, modellogic.lmstudioPort):
-                    classification_client = OpenAI(base_url=f"http://{modellogic.lmstudioIP}:{modellogic.lmstudioPort}/v1", api_key="lm-studio")
-                    model_for_classification = modellogic.lmstudioModel
-                else:
-                    classification_client = OpenAI(api_key=os.environ.get('OPEN_AI_KEY'))
-                    model_for_classification = "gpt-4.1-nano"
-            else:
-                classification_client = OpenAI(api_key=os.environ.get('OPEN_AI_KEY'))
-                model_for_classification = model_choice
-            classification_system_prompt = {"role": "system", "content": "You are a command classifier. Respond with only QUERY, COMMAND, or SHELL."}
-            classification_user_prompt = {"role": "user", "content": f"User input: {command}"}
-            try:
-                classification_response = classification_client.chat.completions.create(
-                    model=model_for_classification,
-                    messages=[classification_system_prompt, classification_user_prompt],
-                    stream=False
-                )
-                intent = classification_response.choices[0].message.content.strip().upper()
-            except Exception as e:
-                print(f"\x1b[91mClassification error: {e}\x1b[0m")
-                intent = "SHELL"
-            if intent == 'QUERY':
-                modellogic.stream_openai(command, history)
-            elif intent == 'COMMAND':
-                ai_response = modellogic.command_openai(command, history)
-                confirmation = input(f"\n\033[94mCodriver:\033[0m Run `{ai_response}`? (Y/n) ")
-                if confirmation.lower() in ('y','', 'yes'):
-                    print(f"\n\x1b[90mRunning {ai_response}\x1b[0m")
-                    # Use the unified execution helper to capture output and errors
-                    execute_and_record(ai_response)
-            elif intent == 'SHELL':
-                execute_and_record(command)
-            else:
-                print("\x1b[91mUnknown intent, defaulting to SHELL.\x1b[0m")
-                execute_and_record(command)
-
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Codriver, your AI-powered command line companion.")
+    parser.add_argument('--profile', nargs='?', const='codriver-profile.jsonl', metavar='FILE',
+                        help="append per-turn timing records as JSON lines (default: codriver-profile.jsonl)")
+    parser.add_argument('--batch', metavar='FILE',
+                        help="run the inputs in FILE ('-' for stdin) without a prompt and write results as JSON lines")
+    parser.add_argument('--output', default='-', metavar='FILE', help="where --batch writes its results (default: stdout)")
+    parser.add_argument('--isolated', action='store_true',
+                        help="give every batch input its own history so inputs run concurrently")
+    parser.add_argument('--concurrency', type=int, metavar='N', help="batch inputs run at once with --isolated (default: batchConcurrency)")
+    parser.add_argument('--unordered', action='store_true', help="write batch results as they complete instead of in input order")
+    parser.add_argument('--execute', action='store_true', help="run the commands generated for COMMAND inputs in batch mode")
+    args = parser.parse_args()
+    if args.profile:
+        profiling.enable(os.path.abspath(args.profile))
+    if args.batch:
+        import batch
+        raise SystemExit(1 if batch.main(args.batch, args.output, defaultIdentity, args.isolated, args.concurrency,
+                                         not args.unordered, args.execute) else 0)
     try:
         main()
     except KeyboardInterrupt:
@@ -0,0 +1,128 @@
+"""
+This module provides tab completion for paths and command names.
+Directory listings are cached until the directory's mtime changes and kept sorted,
+so each keystroke is a binary search instead of a fresh listing.
+"""
+
+import bisect
+import os
+import threading
+
+from prompt_toolkit.completion import Completer, Completion
+
+import intent
+
+MAX_COMPLETIONS = 500
+
+
+class SortedNames:
+    """Names sorted case-insensitively for prefix lookups with bisect."""
+
+    def __init__(self, names):
+        pairs = sorted((name.lower(), name) for name in names)
+        self.keys = [key for key, _ in pairs]
+        self.names = [name for _, name in pairs]
+
+    def starting_with(self, prefix, limit=MAX_COMPLETIONS):
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self.keys, prefix)
+        # Every key with the prefix sorts before prefix + the highest code point.
+        end = bisect.bisect_left(self.keys, prefix + '\U0010ffff', lo=start)
+        return self.names[start:min(end, start + limit)]
+
+
+class DirectoryCache:
+    """Caches sorted directory listings, invalidated by the directory's mtime."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def listing(self, directory):
+        """Returns (SortedNames, set of subdirectory names) for directory, or None if it can't be read."""
+        try:
+            mtime = os.stat(directory).st_mtime
+        except OSError:
+            return None
+        with self._lock:
+            cached = self._entries.get(directory)
+            if cached and cached[0] == mtime:
+                return cached[1], cached[2]
+        names, dirs = [], set()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    names.append(entry.name)
+                    try:
+                        if entry.is_dir():
+                            dirs.add(entry.name)
+                    except OSError:
+                        pass
+        except OSError:
+            return None
+        sorted_names = SortedNames(names)
+        with self._lock:
+            self._entries[directory] = (mtime, sorted_names, dirs)
+        return sorted_names, dirs
+
+
+class ShellCompleter(Completer):
+    """
+    Completes command names for the first word and paths (nested, ~ and @-prefixed) everywhere else.
+    Meant to run with complete_in_thread so lookups never block typing.
+    """
+
+    def __init__(self):
+        self.directories = DirectoryCache()
+        self._commands = None
+
+    def commands(self):
+        """Sorted command names from the PATH index, built once the index is ready."""
+        if self._commands is None:
+            names = intent.executables()
+            if not names:
+                return None
+            builtins = intent.windows_builtins if intent.os_type == 'windows' else intent.linux_builtins
+            self._commands = SortedNames(set(names) | builtins)
+        return self._commands
+
+    def get_completions(self, document, complete_event):
+        text = document.text_before_cursor
+        word = document.get_word_before_cursor(WORD=True)
+        prefix = ''
+        if word.startswith('@'):
+            prefix, word = '@', word[1:]
+        first_word = not text[:len(text) - len(word) - len(prefix)].strip()
+        separators = ('/', os.sep) if os.altsep is None else ('/', os.sep, os.altsep)
+        has_path = any(sep in word for sep in separators) or word.startswith('~')
+
+        if first_word and word and not has_path and not prefix:
+            commands = self.commands()
+            if commands is not None:
+                for name in commands.starting_with(word):
+                    yield Completion(name, start_position=-len(word), display_meta='command')
+
+        directory_part, _, name_part = word.rpartition('/') if '/' in word else ('', '', word)
+        if os.sep != '/' and os.sep in name_part:
+            directory_part, _, name_part = word.rpartition(os.sep)
+        if directory_part or word.startswith(('/', os.sep)):
+            directory = os.path.expanduser(directory_part or os.sep)
+        elif word == '~':
+            return
+        else:
+            directory = '.'
+        listing = self.directories.listing(os.path.abspath(directory))
+        if listing is None:
+            return
+        names, dirs = listing
+        show_hidden = name_part.startswith('.')
+        for name in names.starting_with(name_part):
+            if name.startswith('.') and not show_hidden:
+                continue
+            is_dir = name in dirs
+            yield Completion(
+                name + ('/' if is_dir else ''),
+                start_position=-len(name_part),
+                display=name + ('/' if is_dir else ''),
+                display_meta='dir' if is_dir else '',
+            )
@@ -0,0 +1,185 @@
+"""
+This module keeps the conversation history within a token budget.
+Old command outputs and file contents are compacted first, the system prompt and recent turns are always kept.
+"""
+
+import os
+
+# Default prompt budget, and optional per-model overrides like "gpt-4.1=120000,lmstudio=8000".
+historyTokenBudget = int(os.environ.get('historyTokenBudget') or 32000)
+modelTokenBudgets = {}
+for _entry in (os.environ.get('modelTokenBudgets') or '').split(','):
+    if '=' in _entry:
+        _name, _budget = _entry.split('=', 1)
+        modelTokenBudgets[_name.strip()] = int(_budget)
+# Number of most recent messages that are never compacted or dropped.
+historyKeepRecent = int(os.environ.get('historyKeepRecent') or 6)
+# An over-budget history is compacted to this fraction of the budget, so the turns after it only append
+# and the start of the prompt stays the same for the provider's prompt cache.
+historyCompactTarget = float(os.environ.get('historyCompactTarget') or 0.75)
+
+# Role of command output messages. They come from the user's side, not from the model.
+OUTPUT_ROLE = 'user'
+
+# Lines, and at most this many characters, kept from each end of a compacted output or file.
+STUB_LINES = 10
+STUB_CHARS = 1500
+
+# tiktoken encoding, loaded on first count. False when tiktoken isn't installed.
+_encoding = None
+
+
+def count_tokens(text):
+    """Counts tokens with tiktoken when it is installed, otherwise estimates four characters per token."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding('cl100k_base')
+        except ImportError:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def budget_for(model):
+    return modelTokenBudgets.get(model or '', historyTokenBudget)
+
+
+def detect_kind(message):
+    """Guesses whether a message is a command output, a file, or regular chat."""
+    content = message.get('content') or ''
+    if content.startswith(('Command output', 'Command error')):
+        return 'output'
+    if content.startswith('Here is the content of the file'):
+        return 'file'
+    return 'chat'
+
+
+def stub(content, lines=STUB_LINES, chars=STUB_CHARS):
+    """Shortens content to its first and last lines with a note about what was removed."""
+    all_lines = content.splitlines()
+    if len(all_lines) > lines * 2:
+        removed = len(all_lines) - lines * 2
+        content = "\n".join(all_lines[:lines] + [f"[... {removed} lines compacted to save context ...]"] + all_lines[-lines:])
+    if len(content) > chars * 2:
+        removed = len(content) - chars * 2
+        content = f"{content[:chars]}\n[... {removed} characters compacted to save context ...]\n{content[-chars:]}"
+    return content
+
+
+class ConversationHistory:
+    """
+    A list-like conversation history that tracks the token count of each message.
+    to_messages() returns the messages to send, compacting old entries until they fit the model's budget.
+    Messages are only appended between compactions, so consecutive requests share their prefix.
+    """
+
+    def __init__(self, system_message):
+        self.system_message = system_message
+        self.reset()
+
+    def reset(self):
+        self._messages = []
+        self._kinds = []
+        # Token counts of the first len(_tokens) messages, the rest are counted on first use
+        # so creating the history at startup never loads the tokenizer.
+        self._tokens = []
+        self._total = 0
+        self.last_request = {}
+        # Messages sent right after the system prompt on every request, like attached files.
+        self.pinned = []
+        self.append(self.system_message, kind='system')
+
+    def append(self, message, kind=None):
+        self._messages.append(message)
+        self._kinds.append(kind or detect_kind(message))
+
+    def add_output(self, stdout, stderr):
+        """Records a command's output and errors, each as its own message when there is any."""
+        if stdout.strip():
+            self.append({"role": OUTPUT_ROLE, "content": f"Command output:\n{stdout}"}, kind='output')
+        if stderr.strip():
+            self.append({"role": OUTPUT_ROLE, "content": f"Command error:\n{stderr}"}, kind='output')
+
+    def pin(self, messages):
+        """Sets the pinned messages. Unchanged content keeps the prompt prefix byte-identical."""
+        self.pinned = list(messages)
+
+    @property
+    def total_tokens(self):
+        for message in self._messages[len(self._tokens):]:
+            tokens = count_tokens(message.get('content') or '') + 4
+            self._tokens.append(tokens)
+            self._total += tokens
+        return self._total
+
+    def pop(self, index=-1):
+        self.total_tokens
+        self._kinds.pop(index)
+        self._total -= self._tokens.pop(index)
+        return self._messages.pop(index)
+
+    def __iter__(self):
+        return iter(self._messages)
+
+    def __reversed__(self):
+        return reversed(self._messages)
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __getitem__(self, index):
+        return self._messages[index]
+
+    def _replace(self, index, content):
+        self._messages[index] = dict(self._messages[index], content=content)
+        self.total_tokens
+        tokens = count_tokens(content) + 4
+        self._total += tokens - self._tokens[index]
+        self._tokens[index] = tokens
+
+    def compact(self, budget):
+        """
+        Shrinks the history in place until it fits the budget.
+        Outputs and files are stubbed first, oldest first, then the oldest chat turns are dropped.
+        Returns the number of messages compacted or dropped.
+        """
+        changed = 0
+        protected = max(len(self._messages) - historyKeepRecent, 1)
+        for index in range(1, protected):
+            if self.total_tokens <= budget:
+                return changed
+            if self._kinds[index] in ('output', 'file'):
+                shortened = stub(self._messages[index]['content'])
+                self._kinds[index] = 'compacted'
+                if shortened != self._messages[index]['content']:
+                    self._replace(index, shortened)
+                    changed += 1
+        while self.total_tokens > budget and len(self._messages) > historyKeepRecent + 1:
+            self.pop(1)
+            changed += 1
+        return changed
+
+    def to_messages(self, model=None, extra=None):
+        """
+        Returns the messages for a request to model: the system prompt, pinned messages, the history and
+        any extra messages for this request only. A history over the model's token budget is compacted
+        well below it, rather than just enough, so it isn't rewritten again on the next turn.
+        """
+        budget = budget_for(model)
+        extra = extra or []
+        extra_tokens = sum(count_tokens(m.get('content') or '') + 4 for m in list(extra) + self.pinned)
+        compacted = 0
+        if self.total_tokens > budget - extra_tokens:
+            compacted = self.compact(int((budget - extra_tokens) * historyCompactTarget))
+        messages = self._messages[:1] + self.pinned + self._messages[1:] + list(extra)
+        self.last_request = {
+            'model': model,
+            'messages': len(messages),
+            'tokens': self.total_tokens + extra_tokens,
+            'budget': budget,
+            'compacted': compacted,
+        }
+        return messages
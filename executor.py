@@ -0,0 +1,209 @@
+"""
+This module runs shell commands for Codriver.
+Output is streamed to the terminal as it arrives while only a bounded head and tail is kept for history.
+"""
+
+import codecs
+import collections
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import profiling
+import reducer
+import settings
+
+os_type = 'linux' if os.name == 'posix' else 'windows'
+
+# Seconds before a command is killed, 0 or unset means no timeout.
+commandTimeout = float(os.environ.get('commandTimeout') or 0) or None
+# Bytes of output kept per stream for history and AI context (half from the start, half from the end)
+# when reduceOutput is off; the reducer fits its output to reducer.outputTargetChars instead.
+captureBytes = int(os.environ.get('captureBytes') or 64 * 1024)
+# Pass captured output through the reducer (dedupe, strip noise, keep errors plus head and tail).
+reduceOutput = settings.flag('reduceOutput', True)
+
+# Bytes read at a time. read1 returns whatever is available, so larger reads only help when output is fast.
+READ_SIZE = 64 * 1024
+# Seconds output is still read after the command exits. Background processes it started (daemons,
+# 'cmd &', ssh-agent) keep the pipes open and would otherwise hold the prompt until they exit.
+EXIT_GRACE_SECONDS = 1.0
+
+
+class BoundedBuffer:
+    """Keeps the first and last max_chars/2 characters written to it and counts what was dropped in between."""
+
+    def __init__(self, max_chars=captureBytes):
+        self.head_limit = max_chars // 2
+        self.tail_limit = max_chars - self.head_limit
+        self.head = []
+        self.head_size = 0
+        self.tail = collections.deque()
+        self.tail_size = 0
+        self.dropped = 0
+        self.total = 0
+
+    def write(self, text):
+        self.total += len(text)
+        if self.head_size < self.head_limit:
+            take = text[:self.head_limit - self.head_size]
+            self.head.append(take)
+            self.head_size += len(take)
+            text = text[len(take):]
+        if not text:
+            return
+        self.tail.append(text)
+        self.tail_size += len(text)
+        while self.tail_size > self.tail_limit:
+            overflow = self.tail_size - self.tail_limit
+            first = self.tail[0]
+            if len(first) <= overflow:
+                self.tail.popleft()
+                self.tail_size -= len(first)
+                self.dropped += len(first)
+            else:
+                self.tail[0] = first[overflow:]
+                self.tail_size -= overflow
+                self.dropped += overflow
+
+    def getvalue(self):
+        head = "".join(self.head)
+        tail = "".join(self.tail)
+        if self.dropped:
+            return f"{head}\n[... {self.dropped} characters of output omitted ...]\n{tail}"
+        return head + tail
+
+
+def make_capture(max_chars=None):
+    """Returns the buffer command output is captured into for history and AI context."""
+    if reduceOutput:
+        return reducer.OutputReducer(max_chars)
+    return BoundedBuffer(max_chars or captureBytes)
+
+
+def shell_args(cmd):
+    """Returns (args, shell) for running cmd in PowerShell on Windows or /bin/sh elsewhere."""
+    if os_type == 'windows':
+        return ["powershell", "-ExecutionPolicy", "Bypass", "-Command", cmd], False
+    return cmd, True
+
+
+def process_group():
+    """
+    Popen arguments that start a command in its own process group (its own session on POSIX),
+    so Ctrl-C at the prompt doesn't reach it and kill_group() takes its children too.
+    """
+    if os_type == 'windows':
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {'start_new_session': True}
+
+
+def kill_group(proc):
+    """Kills a process started with process_group() and everything it started."""
+    try:
+        if os_type == 'windows':
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(proc.pid)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def _pump(pipe, buffer, echo_stream, color, stop=None):
+    """Reads a pipe as data arrives, decoding incrementally, until it closes or stop is set."""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    read = getattr(pipe, 'read1', pipe.read)
+    while True:
+        data = read(READ_SIZE)
+        if not data or (stop is not None and stop.is_set()):
+            break
+        text = decoder.decode(data)
+        if not text:
+            continue
+        buffer.write(text)
+        if echo_stream is not None:
+            echo_stream.write(f"{color}{text}\x1b[0m" if color else text)
+            echo_stream.flush()
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        buffer.write(tail)
+    pipe.close()
+
+
+def interrupt(proc):
+    """Sends the equivalent of Ctrl-C to proc."""
+    try:
+        if os_type == 'windows':
+            proc.terminate()
+        else:
+            proc.send_signal(signal.SIGINT)
+    except OSError:
+        pass
+
+
+def wait(proc, timeout=None, on_interrupt=interrupt, on_kill=None):
+    """
+    Waits for proc to exit. The first Ctrl-C is passed on with on_interrupt, a second one kills it with on_kill
+    (proc.kill by default), as does running past timeout seconds. Returns (timed_out, killed).
+    """
+    on_kill = on_kill or (lambda process: process.kill())
+    deadline = time.monotonic() + timeout if timeout else None
+    interrupts = 0
+    timed_out = False
+    killed = False
+    while True:
+        try:
+            proc.wait(timeout=0.1)
+            break
+        except subprocess.TimeoutExpired:
+            if deadline and time.monotonic() > deadline:
+                on_kill(proc)
+                timed_out = killed = True
+        except KeyboardInterrupt:
+            interrupts += 1
+            if interrupts == 1:
+                print("\n\x1b[90m^C sent to command, press Ctrl-C again to kill it.\x1b[0m")
+                on_interrupt(proc)
+            else:
+                on_kill(proc)
+                killed = True
+    return timed_out, killed
+
+
+def run(cmd, echo=True, timeout=None, max_chars=None, cwd=None):
+    """
+    Run a shell command, streaming stdout and stderr to the terminal as they arrive when echo is set.
+    Ctrl-C is passed on to the command instead of stopping Codriver, a second Ctrl-C kills it.
+    Returns a subprocess.CompletedProcess with the reduced (or bounded) stdout and stderr captures.
+    """
+    timeout = commandTimeout if timeout is None else timeout
+    args, shell = shell_args(cmd)
+    started = time.perf_counter()
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=shell, cwd=cwd)
+    stdout, stderr = make_capture(max_chars), make_capture(max_chars)
+    stop = threading.Event()
+    readers = [
+        threading.Thread(target=_pump, args=(proc.stdout, stdout, sys.stdout if echo else None, None, stop), daemon=True),
+        threading.Thread(target=_pump, args=(proc.stderr, stderr, sys.stderr if echo else None, "\x1b[91m", stop), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+    timed_out, killed = wait(proc, timeout)
+    deadline = time.monotonic() + EXIT_GRACE_SECONDS
+    try:
+        for reader in readers:
+            reader.join(timeout=max(0.0, deadline - time.monotonic()))
+    except KeyboardInterrupt:
+        pass
+    # Whatever is still holding the pipes is left running, its output is no longer captured.
+    stop.set()
+    profiling.add_span('subprocess', time.perf_counter() - started)
+    profiling.record('output_bytes', stdout.total + stderr.total)
+    err = stderr.getvalue()
+    if timed_out:
+        err += f"\nError: Command timed out after {timeout:g} seconds."
+    return subprocess.CompletedProcess(proc.args, proc.returncode, stdout.getvalue(), err)
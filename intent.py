@@ -0,0 +1,195 @@
+"""
+This module decides the user's intent locally when it is obvious, so the
+classifying model is only called for input that is actually ambiguous.
+"""
+
+import os
+import re
+import threading
+
+os_type = 'linux' if os.name == 'posix' else 'windows'
+
+# Shell builtins that never show up on PATH but should always go straight to the shell.
+linux_builtins = {
+    'alias', 'bg', 'bind', 'builtin', 'cd', 'command', 'declare', 'echo', 'eval', 'exec',
+    'exit', 'export', 'fc', 'fg', 'hash', 'history', 'jobs', 'kill', 'let', 'local',
+    'popd', 'printf', 'pushd', 'pwd', 'read', 'readonly', 'set', 'shift', 'source',
+    'test', 'times', 'trap', 'type', 'ulimit', 'umask', 'unalias', 'unset', 'wait', '.',
+}
+
+# Common PowerShell aliases, since they are not executables either.
+windows_builtins = {
+    'cat', 'cd', 'chdir', 'clear', 'cls', 'copy', 'cp', 'del', 'dir', 'echo', 'erase',
+    'gc', 'gci', 'gcm', 'gi', 'gl', 'gp', 'gps', 'gsv', 'h', 'history', 'kill', 'ls',
+    'md', 'mkdir', 'mi', 'move', 'mv', 'popd', 'ps', 'pushd', 'pwd', 'r', 'rd', 'ren',
+    'rm', 'rmdir', 'sal', 'select', 'set', 'sl', 'sleep', 'sort', 'start', 'tee',
+    'type', 'where', 'write',
+}
+
+question_words = {
+    'what', "what's", 'whats', 'why', 'how', "how's", 'who', 'where', 'when', 'which',
+    'can', 'could', 'should', 'would', 'is', 'are', 'does', 'do', 'did', 'explain',
+    'tell', 'describe',
+}
+
+# Words that show up in requests ("kill the server", "find big files") but rarely as command arguments.
+prose_words = {
+    'a', 'an', 'the', 'all', 'any', 'every', 'each', 'some', 'my', 'me', 'i', 'this', 'that', 'these',
+    'those', 'it', 'them', 'to', 'for', 'from', 'into', 'of', 'with', 'without', 'and', 'than', 'which',
+    'please', 'big', 'bigger', 'biggest', 'large', 'larger', 'largest', 'small', 'smaller', 'old', 'older',
+    'oldest', 'new', 'newer', 'newest', 'recent', 'empty', 'duplicate',
+}
+
+# Pipes, redirections, chaining, substitutions and globs.
+shell_syntax = re.compile(r"(\|\||&&|[|;<>`]|\$\(|\$\{|\$[A-Za-z_]|\*|~/|\s-{1,2}[A-Za-z0-9])")
+assignment = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*=\S*")
+powershell_cmdlet = re.compile(r"^[A-Za-z]+-[A-Za-z]+$")
+
+_executables = set()
+_aliases = set()
+_index_ready = threading.Event()
+
+# Number of classifier calls the local fast path has answered instead.
+fast_path_hits = 0
+
+
+def _scan_path():
+    """Collects the names of every executable on PATH, plus user shell aliases."""
+    names = set()
+    pathext = [ext.lower() for ext in os.environ.get('PATHEXT', '.EXE;.BAT;.CMD;.PS1').split(';') if ext]
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        try:
+            entries = os.scandir(directory)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if not entry.is_file():
+                        continue
+                except OSError:
+                    continue
+                if os_type == 'windows':
+                    base, ext = os.path.splitext(entry.name)
+                    if ext.lower() in pathext:
+                        names.add(base.lower())
+                        names.add(entry.name.lower())
+                elif os.access(entry.path, os.X_OK):
+                    names.add(entry.name)
+    _executables.update(names)
+    _aliases.update(_read_aliases())
+    _index_ready.set()
+
+
+def _read_aliases():
+    """Reads 'alias name=...' lines from the usual bash startup files."""
+    names = set()
+    if os_type == 'windows':
+        return names
+    for rc in ('~/.bashrc', '~/.bash_aliases', '~/.zshrc'):
+        try:
+            with open(os.path.expanduser(rc), 'r', encoding='utf-8', errors='ignore') as f:
+                for line in f:
+                    match = re.match(r"\s*alias\s+([^=\s]+)=", line)
+                    if match:
+                        names.add(match.group(1))
+        except OSError:
+            continue
+    return names
+
+
+def build_index(background=True):
+    """Builds the PATH executable index, in a daemon thread by default."""
+    if background:
+        threading.Thread(target=_scan_path, daemon=True).start()
+    else:
+        _scan_path()
+
+
+def executables():
+    """Returns the set of executable names indexed from PATH."""
+    return _executables
+
+
+def is_known_command(name):
+    """True if name is a shell builtin, alias or an executable on PATH."""
+    key = name.lower() if os_type == 'windows' else name
+    builtins = windows_builtins if os_type == 'windows' else linux_builtins
+    if key in builtins or key in _aliases:
+        return True
+    if os_type == 'windows' and (powershell_cmdlet.match(name) or re.fullmatch(r"[A-Za-z]:", name)):
+        return True
+    if os.sep in name or (os.altsep and os.altsep in name):
+        return os.path.isfile(os.path.expanduser(name))
+    if _index_ready.is_set():
+        return key in _executables
+    # Index still building, fall back to a direct lookup.
+    import shutil
+    return shutil.which(name) is not None
+
+
+def looks_like_question(command):
+    """True if the input reads like a natural-language question."""
+    words = command.strip().split()
+    if len(words) < 3:
+        return False
+    first = words[0].lower().rstrip(',')
+    if first in question_words:
+        return True
+    return command.rstrip().endswith('?') and '|' not in command
+
+
+def looks_like_natural_language(command):
+    """True if the input reads like a sentence rather than a command line."""
+    words = command.strip().split()
+    if len(words) < 3 or shell_syntax.search(command) or re.search(r"[/\\=\"]", command):
+        return False
+    plain = [word for word in words if re.fullmatch(r"[A-Za-z']+[,.?!]?", word)]
+    return len(plain) >= 0.8 * len(words)
+
+
+def reads_as_request(words):
+    """True if the words after a command name read like English ('the server', 'big files') rather than arguments."""
+    if any(word.lower().strip(',.?!') in prose_words for word in words):
+        return True
+    return len(words) > 3 and looks_like_natural_language(" ".join(words))
+
+
+def names_existing_path(words):
+    """True if one of words looks like a path ('notes.txt', 'src/', '~/logs') and exists."""
+    for word in words:
+        word = word.strip('"\'')
+        if re.search(r"[/\\~]|\w\.\w", word) and os.path.exists(os.path.expanduser(word)):
+            return True
+    return False
+
+
+def fast_classify(command):
+    """
+    Returns 'SHELL' or 'QUERY' when the intent is obvious from the input alone,
+    or None when the classifying model has to decide.
+    """
+    global fast_path_hits
+    text = command.strip()
+    words = text.split()
+    if not words:
+        return None
+    intent = None
+    if assignment.match(text):
+        intent = 'SHELL'
+    elif is_known_command(words[0]):
+        # "kill the server" or "make a backup of ~/docs" start with an executable but are requests. A bare
+        # command, or arguments that aren't English ('git status', 'ls -la ~/src') make it SHELL.
+        # Quoted arguments ('git commit -m "fix the bug"') are text for the command, not the request.
+        request = len(words) > 1 and reads_as_request(re.sub(r"\"[^\"]*\"|'[^']*'", ' ', text).split()[1:])
+        if len(words) == 1 or (not request and (shell_syntax.search(text) or names_existing_path(words[1:]))):
+            intent = 'SHELL'
+        elif looks_like_question(text):
+            intent = 'QUERY'
+        elif not request:
+            intent = 'SHELL'
+    elif looks_like_question(text):
+        intent = 'QUERY'
+    if intent:
+        fast_path_hits += 1
+    return intent
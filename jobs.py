@@ -0,0 +1,188 @@
+"""
+This module runs long commands as background jobs so the prompt stays free.
+Each job keeps its own bounded output capture, can be brought to the foreground, killed,
+or have its output handed to the AI later with '%1 |? question'.
+"""
+
+import atexit
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import executor
+
+# Finished jobs kept around for %N references, oldest dropped first.
+MAX_FINISHED = 20
+# Lines of earlier output shown when a job is brought to the foreground.
+FG_TAIL_LINES = 20
+
+job_reference = re.compile(r"^%(\d+)$")
+
+_jobs = {}
+_next_number = 1
+_lock = threading.Lock()
+
+
+class _Sink:
+    """Captures a job's output and echoes it while the job is in the foreground."""
+
+    def __init__(self, job, capture, stream, color):
+        self.job = job
+        self.capture = capture
+        self.stream = stream
+        self.color = color
+
+    def write(self, text):
+        with self.job.lock:
+            self.capture.write(text)
+            self.job.last_output = (self.job.last_output + text)[-4096:]
+            if self.job.foreground:
+                self.stream.write(f"{self.color}{text}\x1b[0m" if self.color else text)
+                self.stream.flush()
+
+
+class Job:
+    """A command running in its own process group with no terminal input."""
+
+    def __init__(self, number, command, cwd=None):
+        self.number = number
+        self.command = command
+        self.cwd = cwd
+        self.lock = threading.Lock()
+        self.stdout = executor.make_capture()
+        self.stderr = executor.make_capture()
+        self.last_output = ''
+        self.foreground = False
+        self.notified = False
+        self.started = time.monotonic()
+        self.finished = None
+        args, shell = executor.shell_args(command)
+        self.proc = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                     shell=shell, cwd=cwd, **executor.process_group())
+        self._readers = [
+            threading.Thread(target=executor._pump, args=(self.proc.stdout, _Sink(self, self.stdout, sys.stdout, None), None, None), daemon=True),
+            threading.Thread(target=executor._pump, args=(self.proc.stderr, _Sink(self, self.stderr, sys.stderr, "\x1b[91m"), None, None), daemon=True),
+        ]
+        for reader in self._readers:
+            reader.start()
+        threading.Thread(target=self._wait, daemon=True).start()
+
+    def _wait(self):
+        self.proc.wait()
+        for reader in self._readers:
+            reader.join(timeout=1)
+        self.finished = time.monotonic()
+
+    @property
+    def running(self):
+        return self.finished is None
+
+    def status(self):
+        if self.running:
+            return "Running"
+        if self.proc.returncode == 0:
+            return "Done"
+        if self.proc.returncode < 0:
+            return f"Killed ({signal.Signals(-self.proc.returncode).name})" if executor.os_type != 'windows' else "Killed"
+        return f"Exit {self.proc.returncode}"
+
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    def describe(self):
+        return f"[{self.number}] {self.status():<14} {self.elapsed():7.1f}s  {self.command}"
+
+    def output(self):
+        """(stdout, stderr) captured so far."""
+        with self.lock:
+            return self.stdout.getvalue(), self.stderr.getvalue()
+
+    def interrupt(self, proc=None):
+        """Sends Ctrl-C to the job's whole process group."""
+        try:
+            if executor.os_type == 'windows':
+                self.proc.send_signal(signal.CTRL_BREAK_EVENT)
+            else:
+                os.killpg(self.proc.pid, signal.SIGINT)
+        except OSError:
+            pass
+
+    def kill(self, proc=None):
+        """Kills the job and everything it started."""
+        executor.kill_group(self.proc)
+
+    def attach(self):
+        """
+        Brings the job to the foreground: shows the end of its output so far, then streams the rest
+        until it exits. Ctrl-C interrupts the job, a second one kills it.
+        """
+        with self.lock:
+            earlier = self.last_output.splitlines()[-FG_TAIL_LINES:]
+            self.foreground = True
+        if earlier:
+            print("\n".join(earlier))
+        try:
+            executor.wait(self.proc, on_interrupt=self.interrupt, on_kill=self.kill)
+            for reader in self._readers:
+                reader.join(timeout=1)
+        finally:
+            self.foreground = False
+        self.finished = self.finished or time.monotonic()
+        self.notified = True
+
+
+def start(command, cwd=None):
+    """Starts command as a background job and returns it."""
+    global _next_number
+    with _lock:
+        job = Job(_next_number, command, cwd)
+        _jobs[job.number] = job
+        _next_number += 1
+        finished = [number for number, j in _jobs.items() if not j.running]
+        for number in finished[:max(0, len(finished) - MAX_FINISHED)]:
+            del _jobs[number]
+    return job
+
+
+def get(reference=None):
+    """The job for '%N', 'N' or, with no reference, the most recent one. None if there is no such job."""
+    with _lock:
+        if not reference:
+            return _jobs[max(_jobs)] if _jobs else None
+        match = job_reference.match(reference.strip()) or re.match(r"^(\d+)$", reference.strip())
+        return _jobs.get(int(match.group(1))) if match else None
+
+
+def all_jobs():
+    with _lock:
+        return list(_jobs.values())
+
+
+def take_notifications():
+    """Jobs that finished since the last prompt, each returned once."""
+    done = []
+    for job in all_jobs():
+        if not job.running and not job.notified:
+            job.notified = True
+            done.append(job)
+    return done
+
+
+def kill_all():
+    """Kills every job still running, so none outlive Codriver."""
+    for job in all_jobs():
+        if job.running:
+            job.kill()
+
+
+atexit.register(kill_all)
+
+
+def is_background(command):
+    """True for a command ending in a single '&', like 'make build &'."""
+    stripped = command.rstrip()
+    return stripped.endswith('&') and not stripped.endswith(('&&', '>&')) and len(stripped) > 1
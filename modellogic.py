@@ -3,73 +3,715 @@ This module handles the interaction with the AI models.
 """
 
 import os
-from openai import OpenAI
+import queue
+import socket
+import threading
+import time
 from dotenv import load_dotenv
 
+# The only place .env is read. Imported first, so every other module sees its settings.
 load_dotenv()
 
-# Initialize the OpenAI client
-client = OpenAI(api_key=os.environ.get('OPEN_AI_KEY'))
+# These read their settings at import time, so only after .env is loaded.
+import profiling
+import render
+import settings
+
 lmstudioIP = os.environ.get('lmstudioIP')
 lmstudioPort = os.environ.get('lmstudioPort')
 lmstudioModel = os.environ.get('lmstudioModel')
+# More LM Studio servers running the same model, like "192.168.1.20:1234,192.168.1.21:1234".
+lmstudioEndpoints = [entry.strip() for entry in (os.environ.get('lmstudioEndpoints') or '').split(',') if entry.strip()]
 model = os.environ.get('defaultModel')
 classifyingModel = os.environ.get('classifyingModel')
+# How long a backend health check result is trusted before it is refreshed in the background.
+healthCheckTTL = float(os.environ.get('healthCheckTTL') or 30)
+# Send every request to the fastest healthy backend instead of the one picked with gpt-4.1 / llm.
+autoRoute = settings.flag('autoRoute')
+# Retry a request on the next healthy backend when one errors or times out before answering.
+failover = settings.flag('failover', True)
+# Race classification and command generation on the two best backends, keeping whichever answers first.
+hedgeRequests = settings.flag('hedgeRequests')
+# Seconds to wait for the best backend before sending the hedge, 0 sends both at once.
+hedgeDelay = float(os.environ.get('hedgeDelay') or 0.3)
+# Seconds a backend may take to start answering (and between streamed chunks) before it counts as failed.
+firstTokenTimeout = float(os.environ.get('firstTokenTimeout') or 60)
+
+# Weight of the newest sample in each backend's moving averages.
+ROUTER_ALPHA = 0.3
+# Asks streamed responses to end with a usage chunk, which says how much of the prompt was cached.
+STREAM_OPTIONS = {"include_usage": True}
+
+# Fixed instructions, sent once in the system prompt instead of with every request that needs them,
+# so every request starts with the same bytes and the provider's prompt cache (or LM Studio's KV cache) can reuse them.
+INSTRUCTIONS = """When a message starts with "Command request:", the user is asking you to run a command that accomplishes what follows. Since this is a request for YOU to run the command it is VITAL that you reply ONLY with the command. No codeblock. No comments. ONLY REPLY WITH THE COMMAND SO THAT IT CAN BE SENT STRAIGHT THROUGH TO THE OS AND WORK AS EXPECTED. If it's not possible to do what the user wants or it's too dangerous, just reply with the suitable COMMAND to print out why to the screen.
+Messages starting with "Command output:" or "Command error:" are the output of commands the user ran."""
+
+# One long-lived client per backend, so connections are kept alive between turns.
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Per-thread start of the HTTP request in flight, for the time-to-headers span.
+_http_timing = threading.local()
+
+# backend -> (healthy, checked_at)
+_health = {}
+_health_refreshing = set()
+_health_lock = threading.Lock()
+
+_router_lock = threading.Lock()
+
+class Cancelled(Exception):
+    """The user cancelled a request before any of the answer arrived."""
+
+class Cancellation:
+    """
+    Lets another thread (the prompt's Ctrl-C or Esc) stop an answer mid-stream.
+    cancel() closes whatever the request attached, which ends the HTTP stream right away.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._close = None
+        self._lock = threading.Lock()
+
+    def attach(self, close):
+        """Registers close() for the request in flight, calling it at once if already cancelled."""
+        with self._lock:
+            self._close = close
+        if self._event.is_set():
+            close()
+
+    def cancel(self):
+        self._event.set()
+        with self._lock:
+            close = self._close
+        if close is not None:
+            try:
+                close()
+            except Exception:
+                pass
+
+    def is_set(self):
+        return self._event.is_set()
+
+class Backend:
+    """An OpenAI-compatible endpoint, the model it answers with and its recent latency and error rate."""
+
+    def __init__(self, name, kind, model_name, host=None, port=None):
+        self.name = name
+        # 'openai' or 'lmstudio', what the gpt-4.1 and llm commands choose between.
+        self.kind = kind
+        self.model = model_name
+        self.host = host
+        self.port = port
+        # Moving averages of time to first token (seconds, None until measured) and of failures (0 to 1).
+        self.ttft = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+
+    def succeeded(self, ttft):
+        with _router_lock:
+            self.requests += 1
+            self.error_rate -= ROUTER_ALPHA * self.error_rate
+            self.ttft = ttft if self.ttft is None else self.ttft + ROUTER_ALPHA * (ttft - self.ttft)
+
+    def lagged(self, seconds):
+        """Counts a hedged request that was beaten after waiting seconds, so slow backends drop down the ranking."""
+        with _router_lock:
+            if self.ttft is None or self.ttft < seconds:
+                self.ttft = seconds if self.ttft is None else self.ttft + ROUTER_ALPHA * (seconds - self.ttft)
+
+    def failed(self, error=None):
+        """Counts a failure and takes the backend out of rotation until its next health check, unless it was only rate limited."""
+        with _router_lock:
+            self.requests += 1
+            self.failures += 1
+            self.error_rate += ROUTER_ALPHA * (1.0 - self.error_rate)
+        if getattr(error, 'status_code', None) != 429:
+            with _health_lock:
+                _health[self.name] = (False, time.monotonic())
+
+    def expected_wait(self):
+        """Expected seconds to the first token, counting failures as a full timeout. Unmeasured backends go first."""
+        return (self.ttft or 0.0) + self.error_rate * firstTokenTimeout
+
+def _configure_backends():
+    configured = {'openai': Backend('openai', 'openai', model)}
+    endpoints = [(lmstudioIP, lmstudioPort)] if lmstudioIP and lmstudioPort else []
+    for entry in lmstudioEndpoints:
+        host, _, port = entry.rpartition(':')
+        if host and (host, port) not in endpoints:
+            endpoints.append((host, port))
+    for index, (host, port) in enumerate(endpoints):
+        name = 'lmstudio' if index == 0 else f"lmstudio@{host}:{port}"
+        configured[name] = Backend(name, 'lmstudio', lmstudioModel, host, port)
+    return configured
+
+# Every configured backend by name: 'openai', 'lmstudio' and 'lmstudio@host:port' for extra endpoints.
+backends = _configure_backends()
+# The kind picked with the gpt-4.1 / llm commands, tried first unless autoRoute is on.
+preferred = 'openai'
+
+def _on_request(request):
+    _http_timing.started = time.perf_counter()
+
+def _on_response(response):
+    started = getattr(_http_timing, 'started', None)
+    if started is not None:
+        profiling.add_span('http_headers', time.perf_counter() - started)
+        _http_timing.started = None
+
+def _build_client(backend):
+    """Builds an OpenAI client with a keep-alive connection pool for the given backend."""
+    # The SDK takes most of a second to import, so it is only loaded once a client is needed.
+    from openai import OpenAI, DefaultHttpxClient
+    try:
+        import httpx
+    except ImportError:
+        httpx = None
+    http_client = None
+    if httpx is not None:
+        # The SDK default drops idle connections after 5s, which is shorter than most pauses between turns.
+        http_client = DefaultHttpxClient(
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=5, keepalive_expiry=300),
+            timeout=httpx.Timeout(60.0, connect=5.0),
+            event_hooks={'request': [_on_request], 'response': [_on_response]},
+        )
+    target = backends[backend]
+    if target.host:
+        return OpenAI(base_url=f"http://{target.host}:{target.port}/v1", api_key="lm-studio", http_client=http_client)
+    return OpenAI(api_key=os.environ.get('OPEN_AI_KEY'), http_client=http_client)
+
+def get_backend_client(backend):
+    """Returns the shared client for a backend name, creating it on first use."""
+    with _clients_lock:
+        if backend not in _clients:
+            _clients[backend] = _build_client(backend)
+        return _clients[backend]
+
+def is_port_listening(ip_address, port):
+    try:
+        with socket.create_connection((ip_address, port), timeout=1):
+            return True
+    except (OSError, ValueError, TypeError):
+        return False
+
+def _check_health(backend):
+    """Probes a backend and records the result in the health cache."""
+    try:
+        target = backends.get(backend)
+        if target is not None and target.host:
+            healthy = is_port_listening(target.host, target.port)
+        else:
+            # Hosted backends have nothing cheap to probe, a failure keeps them out until this check.
+            healthy = target is not None
+        with _health_lock:
+            _health[backend] = (healthy, time.monotonic())
+    finally:
+        with _health_lock:
+            _health_refreshing.discard(backend)
+
+def refresh_health(backend):
+    """Starts a background health check for a backend unless one is already running."""
+    with _health_lock:
+        if backend in _health_refreshing:
+            return
+        _health_refreshing.add(backend)
+    threading.Thread(target=_check_health, args=(backend,), daemon=True).start()
+
+def is_backend_healthy(backend, wait=False):
+    """
+    Returns the cached health of a backend. Stale entries are refreshed in the background,
+    so this never blocks unless wait=True and there is no fresh result yet.
+    """
+    with _health_lock:
+        cached = _health.get(backend)
+    fresh = cached is not None and time.monotonic() - cached[1] < healthCheckTTL
+    if fresh:
+        return cached[0]
+    if wait:
+        with _health_lock:
+            _health_refreshing.add(backend)
+        _check_health(backend)
+        return _health[backend][0]
+    refresh_health(backend)
+    return cached[0] if cached else False
+
+for _name, _backend in backends.items():
+    if _backend.host:
+        refresh_health(_name)
+    else:
+        _health[_name] = (True, time.monotonic())
+
+def ranked(prefer=None):
+    """
+    Backends to try, best first: the healthy ones of the preferred kind by expected wait, then (with failover)
+    every other healthy one. With autoRoute all healthy backends are ranked by expected wait alone.
+    """
+    prefer = prefer or preferred
+    healthy = sorted((b for name, b in backends.items() if is_backend_healthy(name)), key=Backend.expected_wait)
+    if autoRoute:
+        order = healthy
+    else:
+        order = [b for b in healthy if b.kind == prefer]
+        if failover:
+            order += [b for b in healthy if b.kind != prefer]
+    # Nothing known to be up: try the preferred kind anyway and let the error speak.
+    return order or [b for b in backends.values() if b.kind == prefer] or list(backends.values())
+
+def routed(request, prefer=None):
+    """
+    Calls request(backend) on the best backend and returns its result.
+    When it raises (including timeouts), the next backend is tried, and the last error is raised if all fail.
+    """
+    candidates = ranked(prefer)
+    for index, backend in enumerate(candidates):
+        try:
+            result = request(backend)
+        except Cancelled:
+            raise
+        except Exception as e:
+            backend.failed(e)
+            if index + 1 == len(candidates):
+                raise
+            print(f"\x1b[90m{backend.name} failed ({e}), trying {candidates[index + 1].name}.\x1b[0m")
+            continue
+        profiling.record('backend', backend.name)
+        return result
+
+def hedged(request, prefer=None):
+    """
+    Calls request(backend, cancelled) on the best backend and, if it hasn't answered within hedgeDelay,
+    on the next one too. The first answer wins and the other request is closed through its Cancellation.
+    Failed attempts are replaced by the next backend, like routed(). Without hedgeRequests this is routed().
+    """
+    candidates = ranked(prefer)
+    if not hedgeRequests or len(candidates) < 2:
+        return routed(lambda backend: request(backend, None), prefer)
+    results = queue.Queue()
+    # name -> (backend, Cancellation, launch time) of every attempt still out
+    launched = {}
+
+    def attempt(backend, cancelled):
+        try:
+            results.put((backend, request(backend, cancelled), None))
+        except Exception as e:
+            results.put((backend, None, e))
+
+    def launch():
+        backend, cancelled = candidates.pop(0), Cancellation()
+        launched[backend.name] = (backend, cancelled, time.perf_counter())
+        threading.Thread(target=attempt, args=(backend, cancelled), daemon=True).start()
+
+    launch()
+    running = 1
+    error = None
+    while running:
+        try:
+            # Only wait for the hedge delay while there's a single request out and another backend to race it.
+            backend, result, failure = results.get(timeout=hedgeDelay if running == 1 and candidates else None)
+        except queue.Empty:
+            launch()
+            running += 1
+            profiling.record('hedged', 1)
+            continue
+        running -= 1
+        launched.pop(backend.name, None)
+        if failure is None:
+            now = time.perf_counter()
+            for loser, cancelled, launched_at in launched.values():
+                cancelled.cancel()
+                loser.lagged(now - launched_at)
+            profiling.record('backend', backend.name)
+            return result
+        backend.failed(failure)
+        error = failure
+        if candidates:
+            launch()
+            running += 1
+    raise error
+
+def use_backend(kind, model_name=None):
+    """
+    Prefers backends of kind ('openai' or 'lmstudio') for answers and turns autoRoute off,
+    optionally switching their model. Returns False, changing nothing, if none of them is up.
+    """
+    global preferred, autoRoute
+    names = [name for name, backend in backends.items() if backend.kind == kind]
+    if not any(is_backend_healthy(name, wait=True) for name in names):
+        return False
+    preferred = kind
+    autoRoute = False
+    if model_name:
+        for name in names:
+            backends[name].model = model_name
+    return True
 
-def get_client():
-    """Returns the current OpenAI client."""
-    return client
+def set_auto_route(enabled):
+    global autoRoute
+    autoRoute = enabled
 
-def set_client(new_client):
-    """Sets the OpenAI client."""
-    global client
-    client = new_client
+def _warm():
+    try:
+        get_backend_client(ranked()[0].name)
+    except Exception:
+        # e.g. no API key yet, the first AI turn reports it.
+        pass
+
+def warm_up():
+    """Imports the SDK and builds the best backend's client in the background, so the first AI turn doesn't pay for it."""
+    threading.Thread(target=_warm, daemon=True).start()
 
 def get_model():
-    """Returns the current model."""
-    return model
+    """Returns the model of the backend the next answer will go to."""
+    return ranked()[0].model
 
-def set_model(new_model):
-    """Sets the model."""
-    global model
-    model = new_model
+def router_table():
+    """Recent latency and errors per backend, for the stats command."""
+    mode = 'auto' if autoRoute else f"prefer {preferred}"
+    lines = [f"{'backend':<28}{'model':<16}{'ttft':>8}{'errors':>8}{'reqs':>6}  ({mode})"]
+    for name, backend in backends.items():
+        ttft = f"{backend.ttft:.2f}s" if backend.ttft is not None else '-'
+        state = '' if is_backend_healthy(name) else '  down'
+        lines.append(f"{name:<28}{str(backend.model):<16}{ttft:>8}{backend.error_rate:>8.0%}{backend.requests:>6}{state}")
+    return "\n".join(lines)
 
-def stream_openai(prompt, history):
-    
-    full_message = ""
-    user_response_obj = {"role": "user", "content": prompt}
-    history.append(user_response_obj)
-    
-    response = client.chat.completions.create(model=get_model(), messages=history, stream=True)
-    
-    print("\n\033[94mCodriver:\x1b[0m", end='')
+def system_prompt(identity):
+    """The system message for a conversation: identity's prompt followed by the fixed INSTRUCTIONS."""
+    return {"role": "system", "content": identity["content"].rstrip() + "\n\n" + INSTRUCTIONS}
+
+def command_request(prompt):
+    """The user message asking for a command, see INSTRUCTIONS."""
+    return {"role": "user", "content": f"Command request: {prompt}"}
+
+def _read_usage(reported, usage):
+    """Copies the prompt token counts from a response's usage into the usage dict."""
+    usage['prompt'] = reported.prompt_tokens or 0
+    details = getattr(reported, 'prompt_tokens_details', None)
+    # Servers that don't report caching leave it out, rather than claim nothing was cached.
+    if details is not None and getattr(details, 'cached_tokens', None) is not None:
+        usage['cached'] = details.cached_tokens
+
+def record_usage(usage, sent=None):
+    """Records the prompt tokens served from the prompt cache on the turn, and on the request's sent summary."""
+    if 'cached' not in usage:
+        return
+    profiling.record('cached_tokens', usage['cached'])
+    profiling.record('reported_prompt_tokens', usage['prompt'])
+    if sent is not None:
+        sent['cached'] = usage['cached']
+
+def _content(response, usage=None):
+    """Yields the text pieces of a streamed chat completion, filling usage from its usage chunk."""
     for data in response:
+        if usage is not None and getattr(data, 'usage', None):
+            _read_usage(data.usage, usage)
         for choice in data.choices:
             if choice.delta and choice.delta.content:
-                chunk = choice.delta.content
-                print(chunk, end='')
-                full_message += chunk
-                
+                yield choice.delta.content
+
+def _complete(backend, model_name, messages, cancelled=None, usage=None):
+    """
+    Streams a short completion from backend and returns its text, recording the time to first token.
+    Returns None once the cancelled Cancellation is set, which closes the connection even before the first token.
+    """
+    started = time.perf_counter()
+    response = get_backend_client(backend.name).chat.completions.create(
+        model=model_name, messages=messages, stream=True, stream_options=STREAM_OPTIONS, timeout=firstTokenTimeout)
+    if cancelled is not None:
+        cancelled.attach(response.close)
+    pieces = []
+    try:
+        for piece in _content(response, usage):
+            # A hedge that lost still tells us how slow its backend was.
+            if not pieces:
+                backend.succeeded(time.perf_counter() - started)
+            if cancelled is not None and cancelled.is_set():
+                return None
+            pieces.append(piece)
+    except Exception:
+        # Reading a stream that was closed from the other thread fails, that's the cancellation.
+        if cancelled is not None and cancelled.is_set():
+            return None
+        raise
+    finally:
+        response.close()
+    if cancelled is not None and cancelled.is_set():
+        return None
+    return "".join(pieces)
+
+def classify(command, model_choice):
+    """
+    Asks the classifying model whether the input is a QUERY, COMMAND or SHELL.
+    model_choice 'lmstudio' prefers the local servers, anything else is the OpenAI model to use;
+    the router fails over (or hedges) to the other backends, with gpt-4.1-nano on OpenAI.
+    """
+    prefer = 'lmstudio' if model_choice.lower() == 'lmstudio' else 'openai'
+    classification_system_prompt = {"role": "system", "content": "You are a command classifier. Respond with only QUERY, COMMAND, or SHELL."}
+    classification_user_prompt = {"role": "user", "content": f"User input: {command}"}
+
+    def request(backend, cancelled):
+        if backend.kind == 'lmstudio':
+            model_for_classification = backend.model
+        else:
+            model_for_classification = model_choice if prefer == 'openai' else "gpt-4.1-nano"
+        return _complete(backend, model_for_classification, [classification_system_prompt, classification_user_prompt], cancelled)
+
+    with profiling.span('classify'):
+        classification = hedged(request, prefer)
+    return classification.strip().upper()
+
+def record_generation(started, first_token_at, tokens):
+    """Records total generation time and tokens/sec (streamed deltas, roughly one token each) for the turn."""
+    finished = time.perf_counter()
+    profiling.add_span('generate', finished - started)
+    profiling.record('completion_tokens', tokens)
+    if first_token_at is not None and finished > first_token_at and tokens > 1:
+        profiling.record('tokens_per_sec', (tokens - 1) / (finished - first_token_at))
+
+def _open_stream(backend, messages, cancel=None):
+    """
+    Starts a streamed answer on backend and waits for its first token, so errors and timeouts
+    before anything is shown can still fail over. Returns (started, first_token_at, first piece, rest, usage);
+    usage is filled in once the rest has been read. Raises Cancelled if cancel is set before the first token.
+    """
+    started = time.perf_counter()
+    response = get_backend_client(backend.name).chat.completions.create(
+        model=backend.model, messages=messages, stream=True, stream_options=STREAM_OPTIONS, timeout=firstTokenTimeout)
+    if cancel is not None:
+        cancel.attach(response.close)
+    usage = {}
+    pieces = _content(response, usage)
+    try:
+        first = next(pieces, '')
+    except Exception:
+        response.close()
+        if cancel is not None and cancel.is_set():
+            raise Cancelled()
+        raise
+    if cancel is not None and cancel.is_set():
+        raise Cancelled()
+    first_token_at = time.perf_counter()
+    backend.succeeded(first_token_at - started)
+    return started, first_token_at, first, pieces, usage
+
+def _finish_answer(history, full_message, interrupted):
+    """Records the answer in history; an interrupted one is kept as far as it got, marked as such."""
+    if interrupted:
+        full_message += "\n[answer interrupted]"
     history.append({"role": "assistant", "content": full_message})
-    print("\n")
+
+def stream_openai(prompt, history, context=None, echo=True, cancel=None):
+    """
+    Streams an answer to prompt from the best backend and records the turn in history.
+    context messages (e.g. retrieved file excerpts) are sent with this request only.
+    The answer is rendered as it arrives when echo is set, and returned either way.
+    Setting cancel stops the stream; whatever arrived by then is kept in history and returned.
+    """
+    user_response_obj = {"role": "user", "content": prompt}
+
+    def request(backend):
+        messages = history.to_messages(backend.model, extra=(context or []) + [user_response_obj])
+        return _open_stream(backend, messages, cancel)
+
+    try:
+        started, first_token_at, first, pieces, usage = routed(request)
+    except Cancelled:
+        if echo:
+            print("\n\x1b[90m(cancelled)\x1b[0m")
+        return ''
+    history.append(user_response_obj)
+    profiling.record('prompt_tokens', history.last_request.get('tokens', 0))
+    profiling.add_span('ttft', first_token_at - started)
+
+    renderer = None
+    if echo:
+        print("\n\033[94mCodriver:\x1b[0m", end='', flush=True)
+        renderer = render.Renderer()
+        renderer.write(first)
+    full_message = first
+    chunks = 1 if first else 0
+    try:
+        for chunk in pieces:
+            chunks += 1
+            if renderer is not None:
+                renderer.write(chunk)
+            full_message += chunk
+    except Exception:
+        # Closing the response from another thread ends the stream with an error.
+        if cancel is None or not cancel.is_set():
+            raise
+    finally:
+        if renderer is not None:
+            renderer.close()
+    interrupted = cancel is not None and cancel.is_set()
+
+    record_generation(started, first_token_at, chunks)
+    record_usage(usage, history.last_request)
+    _finish_answer(history, full_message, interrupted)
+    if echo:
+        print("\n\x1b[90m(cancelled)\x1b[0m\n" if interrupted else "\n")
     return full_message
 
-def command_openai(prompt, history):
-    
-    user_response_obj = {
-        "role": "user",
-        "content": f"""The user is asking you to run a command that accomplishes the following: {prompt} 
-                         -- Since this is a request for YOU to run the command it is VITAL that you reply ONLY with the command. 
-                         No codeblock. No comments. ONLY REPLY WITH THE COMMAND SO THAT IT CAN BE SENT STRAIGHT THROUGH TO THE OS AND WORK AS EXPECTED. 
-                         If it's not possible to do what the user wants or it's too dangerous, just reply with the suitable COMMAND to print out why to the screen."""
-    }
+WATCH_SUMMARY_CHARS = 1500
+
+def watch_update(command, instruction, summary, excerpt):
+    """
+    Asks about a new window of watched output (the |?~ syntax), outside the conversation history.
+    Returns (alert, summary): alert is None when nothing needs the user's attention, summary carries forward.
+    """
+    messages = [
+        {"role": "system", "content": """You are Codriver, watching the live output of a command for the user.
+Each update has the new interesting lines since the last one and your summary so far.
+If anything in the new lines needs the user's attention given their instruction, start your reply with ALERT: and say what and why in a sentence or two.
+Otherwise start your reply with OK.
+End with a line starting with SUMMARY: that updates the summary so far in at most 80 words."""},
+        {"role": "user", "content": f"Command: `{command}`\nInstruction: {instruction}\nSummary so far: {summary or 'nothing yet'}\nNew output:\n{excerpt}"},
+    ]
+    reply = routed(lambda backend: _complete(backend, backend.model, messages))
+    answer, marker, new_summary = reply.rpartition("SUMMARY:")
+    if not marker:
+        answer, new_summary = reply, summary
+    answer = answer.strip()
+    alert = None
+    if not answer.upper().startswith("OK"):
+        alert = answer[len("ALERT:"):].strip() if answer.upper().startswith("ALERT:") else answer
+    return alert or None, new_summary.strip()[:WATCH_SUMMARY_CHARS]
+
+def pipe_prompt(command, question, had_output):
+    """The question asked about a command's output (the |? syntax), with the output itself already in history."""
+    if had_output:
+        return f"""The user ran the command: `{command}`
+Its output is in the previous message(s).
+Question: "{question}"
+"""
+    return f"""The user ran the command: `{command}`
+It produced no output.
+Question: "{question}"
+"""
+
+class SpeculativeQuery:
+    """
+    Starts a QUERY stream while the intent is still being classified and buffers its tokens.
+    Nothing is added to history until commit(), so cancel() leaves the conversation untouched.
+    """
+
+    def __init__(self, prompt, history, context=None):
+        self.user_message = {"role": "user", "content": prompt}
+        self.backend = ranked()[0]
+        self.messages = history.to_messages(self.backend.model, extra=(context or []) + [self.user_message])
+        self.prompt_tokens = history.last_request.get('tokens', 0)
+        self.chunks = queue.Queue()
+        self.cancelled = threading.Event()
+        self.started_at = time.perf_counter()
+        self.first_token_at = None
+        self.error = None
+        self.usage = {}
+        self._response = None
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        try:
+            client = get_backend_client(self.backend.name)
+            self._response = client.chat.completions.create(
+                model=self.backend.model, messages=self.messages, stream=True, stream_options=STREAM_OPTIONS,
+                timeout=firstTokenTimeout)
+            if self.cancelled.is_set():
+                self._response.close()
+                return
+            for data in self._response:
+                if self.cancelled.is_set():
+                    break
+                if getattr(data, 'usage', None):
+                    _read_usage(data.usage, self.usage)
+                for choice in data.choices:
+                    if choice.delta and choice.delta.content:
+                        if self.first_token_at is None:
+                            self.first_token_at = time.perf_counter()
+                            self.backend.succeeded(self.first_token_at - self.started_at)
+                        self.chunks.put(choice.delta.content)
+        except Exception as e:
+            if not self.cancelled.is_set():
+                self.backend.failed(e)
+                self.error = e
+        finally:
+            self.chunks.put(None)
+
+    def cancel(self):
+        """Stops the stream and closes its HTTP response."""
+        self.cancelled.set()
+        if self._response is not None:
+            try:
+                self._response.close()
+            except Exception:
+                pass
+
+    def commit(self, history, cancel=None):
+        """
+        Flushes the buffered tokens, keeps streaming the rest of the answer and records the turn in history.
+        Setting cancel stops the stream and keeps the partial answer, like stream_openai.
+        Returns the time to first token saved compared to classifying first, in seconds.
+        """
+        classified_at = time.perf_counter()
+        if cancel is not None:
+            cancel.attach(self.cancel)
+        history.append(self.user_message)
+        full_message = ""
+        chunks = 0
+        print("\n\033[94mCodriver:\x1b[0m", end='', flush=True)
+        renderer = render.Renderer()
+        try:
+            while True:
+                chunk = self.chunks.get()
+                if chunk is None:
+                    break
+                chunks += 1
+                renderer.write(chunk)
+                full_message += chunk
+        finally:
+            renderer.close()
+        interrupted = self.cancelled.is_set()
+        if self.error is not None or (interrupted and not full_message):
+            history.pop()
+            if self.error is not None:
+                raise self.error
+            print("\n\x1b[90m(cancelled)\x1b[0m")
+            return 0.0
+        profiling.record('prompt_tokens', self.prompt_tokens)
+        profiling.record('backend', self.backend.name)
+        if self.first_token_at is not None:
+            profiling.add_span('ttft', self.first_token_at - self.started_at)
+        record_generation(self.started_at, self.first_token_at, chunks)
+        record_usage(self.usage, history.last_request)
+        _finish_answer(history, full_message, interrupted)
+        print("\n\x1b[90m(cancelled)\x1b[0m\n" if interrupted else "\n")
+        # Serially this turn would have waited for classification plus the stream's own TTFT.
+        ttft = (self.first_token_at or time.perf_counter()) - self.started_at
+        return min(classified_at - self.started_at, ttft)
+
+def command_openai(prompt, history, context=None):
+    """
+    Asks for a command that does what prompt describes and records the turn in history.
+    How to answer is in the system prompt (INSTRUCTIONS), so the request itself stays short.
+    """
+    user_response_obj = command_request(prompt)
+    history_lock = threading.Lock()
+
+    def request(backend, cancelled):
+        # Hedged attempts build their messages concurrently, and compaction changes history in place.
+        with history_lock:
+            messages = history.to_messages(backend.model, extra=(context or []) + [user_response_obj])
+            sent = dict(history.last_request)
+        usage = {}
+        return _complete(backend, backend.model, messages, cancelled, usage), sent, usage
+
+    with profiling.span('generate'):
+        full_message, history.last_request, usage = hedged(request)
+
     history.append(user_response_obj)
-    
-    # Use a non-streaming request for robustness, as we expect a single, complete command.
-    response = client.chat.completions.create(model=get_model(), messages=history, stream=False)
-    
-    # Extract the full message content from the non-streaming response.
-    full_message = response.choices[0].message.content
-                
+    profiling.record('prompt_tokens', history.last_request.get('tokens', 0))
+    record_usage(usage, history.last_request)
     history.append({"role": "assistant", "content": full_message})
     return full_message
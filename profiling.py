@@ -0,0 +1,167 @@
+"""
+This module records where each turn spends its time: the classifier round trip, time to
+first token, generation, prompt size and subprocess wall time.
+A compact summary goes in the status line, --profile appends one JSON record per turn,
+and the stats command shows p50/p95 per stage for the session.
+"""
+
+import contextlib
+import json
+import threading
+import time
+
+# Where --profile writes its JSONL records, None when profiling is off.
+profilePath = None
+
+# Every finished turn of this session.
+turns = []
+
+_current = None
+_lock = threading.Lock()
+
+
+class Turn:
+    """Timings (in seconds) and metrics gathered while handling one input."""
+
+    def __init__(self, command):
+        self.command = command
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.metrics = {}
+        self.finished = False
+
+    def to_record(self):
+        return {
+            'time': self.started_at,
+            'command': self.command,
+            'total': time.perf_counter() - self.started,
+            'spans': {name: round(value, 6) for name, value in self.spans.items()},
+            'metrics': self.metrics,
+        }
+
+
+def enable(path):
+    """Turns on JSONL profiling to path."""
+    global profilePath
+    profilePath = path
+
+
+def start_turn(command):
+    global _current
+    _current = Turn(command)
+    return _current
+
+
+def current():
+    """The turn being measured, so a thread finishing it later can end that one and not the next."""
+    return _current
+
+
+def add_span(name, seconds):
+    """Adds seconds to the named span of the current turn."""
+    turn = _current
+    if turn is not None:
+        with _lock:
+            turn.spans[name] = turn.spans.get(name, 0.0) + seconds
+
+
+def record(name, value):
+    """Sets a metric (tokens, bytes, ...) on the current turn, adding to it if it is a number already set."""
+    turn = _current
+    if turn is None:
+        return
+    with _lock:
+        if isinstance(value, (int, float)) and isinstance(turn.metrics.get(name), (int, float)):
+            turn.metrics[name] += value
+        else:
+            turn.metrics[name] = value
+
+
+@contextlib.contextmanager
+def span(name):
+    """Times the wrapped block into the named span of the current turn."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_span(name, time.perf_counter() - started)
+
+
+def end_turn(turn=None):
+    """
+    Finishes turn (the current one by default), writes it to the profile and returns it,
+    or None if nothing was measured or it was finished already.
+    """
+    global _current
+    with _lock:
+        turn = turn or _current
+        if turn is _current:
+            _current = None
+        if turn is None or turn.finished:
+            return None
+        turn.finished = True
+    if not (turn.spans or turn.metrics):
+        return None
+    entry = turn.to_record()
+    turns.append(entry)
+    if profilePath:
+        try:
+            with open(profilePath, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            print(f"\x1b[91mProfile write failed: {e}\x1b[0m")
+    return entry
+
+
+def _size(count):
+    return f"{count / 1000:.1f}k" if count >= 1000 else str(count)
+
+
+def summary(entry):
+    """One-line summary of a turn for the status line."""
+    spans, metrics = entry['spans'], entry['metrics']
+    parts = []
+    if 'backend' in metrics:
+        parts.append(metrics['backend'] + (" (hedged)" if metrics.get('hedged') else ""))
+    if 'classify' in spans:
+        parts.append(f"classify {spans['classify']:.2f}s")
+    if 'ttft' in spans:
+        parts.append(f"ttft {spans['ttft']:.2f}s")
+    if 'generate' in spans:
+        rate = f" {metrics['tokens_per_sec']:.0f} tok/s" if metrics.get('tokens_per_sec') else ''
+        parts.append(f"gen {spans['generate']:.2f}s{rate}")
+    if 'prompt_tokens' in metrics:
+        cached = f" ({_size(metrics['cached_tokens'])} cached)" if 'cached_tokens' in metrics else ''
+        parts.append(f"prompt {_size(metrics['prompt_tokens'])} tok{cached}")
+    if 'subprocess' in spans:
+        parts.append(f"cmd {spans['subprocess']:.2f}s {_size(metrics.get('output_bytes', 0))}B")
+    return " | ".join(parts)
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def stats_table():
+    """p50/p95 per stage across this session's turns."""
+    stages = {}
+    for entry in turns:
+        for name, value in entry['spans'].items():
+            stages.setdefault(name, []).append(value)
+        stages.setdefault('total', []).append(entry['total'])
+    if not stages:
+        return "No turns measured yet."
+    lines = [f"{'stage':<14}{'count':>7}{'p50':>10}{'p95':>10}"]
+    for name, values in stages.items():
+        lines.append(f"{name:<14}{len(values):>7}{_percentile(values, 0.5):>9.3f}s{_percentile(values, 0.95):>9.3f}s")
+    rates = [r['metrics']['tokens_per_sec'] for r in turns if r['metrics'].get('tokens_per_sec')]
+    if rates:
+        lines.append(f"{'tokens/sec':<14}{len(rates):>7}{_percentile(rates, 0.5):>10.1f}{_percentile(rates, 0.95):>10.1f}")
+    reported = [r['metrics'] for r in turns if 'cached_tokens' in r['metrics']]
+    prompt_tokens = sum(m.get('reported_prompt_tokens', 0) for m in reported)
+    if prompt_tokens:
+        cached = sum(m['cached_tokens'] for m in reported)
+        lines.append(f"prompt cache: {cached / prompt_tokens:.0%} of {_size(prompt_tokens)} prompt tokens over {len(reported)} turns")
+    return "\n".join(lines)
@@ -0,0 +1,241 @@
+"""
+This module shrinks command output before it goes into the AI context.
+Output is fed in chunks as the command runs and only bounded windows are kept, so
+large outputs are never held in memory in full.
+"""
+
+import collections
+import copy
+import os
+import re
+
+# Characters of reduced output kept per stream for history and AI context.
+outputTargetChars = int(os.environ.get('outputTargetChars') or 8000)
+
+HEAD_LINES = 40
+TAIL_LINES = 60
+MAX_IMPORTANT = 80
+# Once this many lines were reduced, later ones are held back and only the last of them are fully reduced.
+WINDOW_LINES = TAIL_LINES * 10
+
+ansi_escape = re.compile(r"\x1b(?:\[[0-?]*[ -/]*[@-~]|\][^\x07\x1b]*(?:\x07|\x1b\\)|[@-Z\\-_])")
+progress_bar = re.compile(r"(\[[=#>\-. ]{5,}\]|[█▉▊▋▌▍▎▏░▒▓]{3,}|\|[#=\- ]{5,}\||^\s*\d{1,3}(\.\d+)?%\s*$)")
+important = re.compile(r"\b(error|errors|fatal|fail|failed|failure|exception|traceback|panic|warn|warning|denied|refused|not found|segfault|critical)\b", re.IGNORECASE)
+# Words that any line matching important contains, found with plain substring search.
+important_words = ('error', 'fatal', 'fail', 'exception', 'traceback', 'panic', 'warn', 'denied', 'refused',
+                   'not found', 'segfault', 'critical')
+# Numbers, hex ids, timestamps and quoted values that make otherwise identical log lines differ.
+variable_parts = re.compile(r"0x[0-9a-fA-F]+|\b[0-9a-fA-F]{8,}\b|\d+(?:[.:\-/]\d+)*|\"[^\"]*\"|'[^']*'")
+
+
+def signature(line):
+    """Returns the line with its variable parts masked, so near-identical log lines compare equal."""
+    return variable_parts.sub('#', line).strip()
+
+
+class OutputReducer:
+    """
+    Streaming reducer for command output. write() accepts chunks as they arrive,
+    getvalue() returns the reduced text fitted to target_chars.
+    Output that fits the target is kept as is apart from ANSI codes and progress bars. Larger output
+    keeps a head window, a tail window and deduplicated error/warning lines in between.
+    """
+
+    def __init__(self, target_chars=None):
+        self.target_chars = target_chars or outputTargetChars
+        self.partial = ''
+        # Cleaned lines are held verbatim until they outgrow the target, then reduction starts.
+        self.verbatim = []
+        self.verbatim_size = 0
+        self.reducing = False
+        self.head = []
+        self.head_closed = False
+        self.tail = collections.deque(maxlen=TAIL_LINES)
+        self.window = collections.deque(maxlen=WINDOW_LINES)
+        # Lines deferred since the window was last reduced, and the ones among them that may be errors/warnings.
+        self.deferred = 0
+        self.candidates = collections.deque()
+        self.important = collections.OrderedDict()
+        self.last_signature = None
+        self.run_last = None
+        self.repeats = 0
+        self.lines = 0
+        self.evicted = 0
+        self.dropped_progress = 0
+        self.total = 0
+
+    def write(self, text):
+        self.total += len(text)
+        text = self.partial + text
+        lines = text.split('\n')
+        self.partial = lines.pop()
+        # An unterminated line that keeps growing (e.g. a progress bar without newlines) is kept bounded.
+        if len(self.partial) > 4096:
+            self.partial = self.partial[-4096:]
+        self._add_lines(lines)
+
+    def _add_lines(self, lines):
+        for position, line in enumerate(lines):
+            if self.reducing and self.lines >= WINDOW_LINES:
+                self._defer(lines[position:])
+                return
+            self._add(line)
+
+    def _defer(self, lines):
+        """
+        Far into a large output a line only shows up in the result if it is an error/warning or among the last ones.
+        The lines wait in a window and only the ones still there when the value is read get the full (much slower)
+        reduction. Errors and warnings are picked out with a substring search over the whole block and checked
+        properly only if they are pushed out of the window.
+        """
+        lowered = '\n'.join(lines).lower()
+        found = []
+        for important_word in important_words:
+            position = lowered.find(important_word)
+            while position != -1:
+                found.append(position)
+                position = lowered.find(important_word, position + 1)
+        number, previous = 0, 0
+        for position in sorted(found):
+            number += lowered.count('\n', previous, position)
+            previous = position
+            if not self.candidates or self.candidates[-1][0] != self.deferred + number:
+                self.candidates.append((self.deferred + number, lines[number]))
+        self.deferred += len(lines)
+        self.window.extend(lines)
+        while self.candidates and self.candidates[0][0] < self.deferred - WINDOW_LINES:
+            line = self._clean(self.candidates.popleft()[1])
+            if important.search(line) and not progress_bar.search(line):
+                self._note_important(line, signature(line))
+
+    def _catch_up(self):
+        """Fully reduces the deferred lines still in the window."""
+        skipped = self.deferred - len(self.window)
+        if skipped:
+            # The skipped lines were only searched for errors and warnings, a run of similar lines ends there.
+            self._flush_repeats()
+            self.last_signature = None
+            self.head_closed = True
+            self.lines += skipped
+            self.evicted += skipped
+        window, self.window = self.window, collections.deque(maxlen=WINDOW_LINES)
+        self.candidates.clear()
+        self.deferred = 0
+        for line in window:
+            self._add(line)
+
+    def _clean(self, line):
+        line = ansi_escape.sub('', line)
+        # Carriage returns redraw the line in place, only the final state matters.
+        if '\r' in line:
+            line = line.rstrip('\r').split('\r')[-1]
+        return line.rstrip()
+
+    def _flush_repeats(self):
+        """Writes out a run of similar lines as a count followed by the run's last line."""
+        if not self.repeats:
+            return
+        notes = [f"[... {self.repeats - 1} similar lines ...]", self.run_last] if self.repeats > 1 else [self.run_last]
+        for note in notes:
+            if len(self.head) < HEAD_LINES and not self.head_closed:
+                self.head.append(note)
+            else:
+                self._append_tail(note)
+        self.repeats = 0
+
+    def _append_tail(self, line):
+        if len(self.tail) == self.tail.maxlen:
+            self.evicted += 1
+        self.tail.append(line)
+
+    def _add(self, raw):
+        line = self._clean(raw)
+        if progress_bar.search(line):
+            self.dropped_progress += 1
+            return
+        if not self.reducing:
+            self.verbatim.append(line)
+            self.verbatim_size += len(line) + 1
+            if self.verbatim_size <= self.target_chars:
+                return
+            self.reducing = True
+            held, self.verbatim = self.verbatim, []
+            for held_line in held:
+                self._reduce(held_line)
+            return
+        self._reduce(line)
+
+    def _reduce(self, line):
+        self.lines += 1
+        sig = signature(line)
+        if sig == self.last_signature:
+            self.repeats += 1
+            self.run_last = line
+            return
+        self._flush_repeats()
+        self.last_signature = sig
+        if len(self.head) < HEAD_LINES and not self.head_closed:
+            self.head.append(line)
+            return
+        if important.search(line):
+            self._note_important(line, sig)
+        self._append_tail(line)
+
+    def _note_important(self, line, sig):
+        if sig in self.important:
+            self.important[sig][1] += 1
+        elif len(self.important) < MAX_IMPORTANT:
+            self.important[sig] = [line, 1]
+
+    def getvalue(self):
+        """
+        Returns the reduced output so far. The reduction runs on a copy, so a command still running
+        (a background job read with '%1 |?') keeps writing to an unfinished line and window as before.
+        """
+        return copy.deepcopy(self)._finish()
+
+    def _finish(self):
+        if self.partial:
+            self._add_lines([self.partial])
+            self.partial = ''
+        self._catch_up()
+        if not self.reducing:
+            parts = self.verbatim + ([f"[{self.dropped_progress} progress lines removed]"] if self.dropped_progress else [])
+            return "\n".join(parts) + ("\n" if parts else '')
+        self._flush_repeats()
+        head = list(self.head)
+        tail = list(self.tail)
+        shown = set(head) | set(tail)
+        middle = []
+        for line, count in self.important.values():
+            if line in shown:
+                continue
+            middle.append(f"{line}  [x{count} similar]" if count > 1 else line)
+        while True:
+            text = self._assemble(head, middle, tail)
+            # Shrink the head and tail windows before cutting into the error/warning lines.
+            if len(text) <= self.target_chars or len(head) + len(tail) <= 4:
+                return fit(text, self.target_chars)
+            head = head[:max(len(head) // 2, 2)]
+            tail = tail[-max(len(tail) // 2, 2):]
+
+    def _assemble(self, head, middle, tail):
+        hidden = self.evicted or len(head) < len(self.head) or len(tail) < len(self.tail)
+        parts = list(head)
+        if hidden or middle:
+            parts += [f"[... output of {self.lines} lines reduced, {len(middle)} error/warning lines kept ...]"] + middle
+            if tail:
+                parts.append("[... end of output ...]")
+        parts += tail
+        if self.dropped_progress:
+            parts.append(f"[{self.dropped_progress} progress lines removed]")
+        return "\n".join(parts) + ("\n" if parts else '')
+
+
+def fit(text, target_chars):
+    """Cuts text down to target_chars, keeping its start and end."""
+    if len(text) <= target_chars:
+        return text
+    keep = target_chars // 2
+    return f"{text[:keep]}\n[... {len(text) - keep * 2} characters omitted ...]\n{text[-keep:]}"
+
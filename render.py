@@ -0,0 +1,172 @@
+"""
+This module renders streamed answers. Tokens are collected and written in frames at a fixed
+refresh rate instead of one write per token, and markdown (headings, bold, inline code and
+fenced code blocks) is styled line by line as it arrives.
+"""
+
+import os
+import re
+import sys
+import threading
+import time
+
+import settings
+
+# Frames written per second while an answer streams.
+renderFPS = float(os.environ.get('renderFPS') or 30)
+# Style markdown in answers, off writes the text exactly as it arrives.
+renderMarkdown = settings.flag('renderMarkdown', True)
+
+# Seconds the start of a line is held back while it might still turn out to be a heading or code fence.
+HOLD_SECONDS = 0.25
+
+RESET = "\x1b[0m"
+BOLD = "\x1b[1m"
+HEADING = "\x1b[1;94m"
+CODE = "\x1b[36m"
+FENCE = "\x1b[90m"
+COMMENT = "\x1b[90m"
+STRING = "\x1b[33m"
+
+fence = re.compile(r"^\s*```")
+heading = re.compile(r"^(#{1,6})\s+(.*)$")
+inline_code = re.compile(r"`([^`]+)`")
+bold = re.compile(r"\*\*([^*]+)\*\*")
+code_tokens = re.compile(r"(?P<comment>(?:^|\s)(?:#|//).*$)|(?P<string>\"(?:[^\"\\]|\\.)*\"|'(?:[^'\\]|\\.)*')")
+
+
+def style_inline(text):
+    text = inline_code.sub(lambda m: f"{CODE}{m.group(1)}{RESET}", text)
+    return bold.sub(lambda m: f"{BOLD}{m.group(1)}{RESET}", text)
+
+
+def style_code(line):
+    def colour(match):
+        kind = 'comment' if match.group('comment') else 'string'
+        return f"{COMMENT if kind == 'comment' else STRING}{match.group(0)}{CODE}"
+    return f"{CODE}{code_tokens.sub(colour, line)}{RESET}"
+
+
+def _unclosed(text):
+    """Index of an inline ` or ** opener without its closer yet, or None. A trailing * may be half of one."""
+    position = None
+    index = 0
+    while index < len(text):
+        marker = '**' if text.startswith('**', index) else '`' if text[index] == '`' else None
+        if marker is None:
+            if text[index] == '*' and index == len(text) - 1:
+                return index
+            index += 1
+            continue
+        closer = text.find(marker, index + len(marker))
+        if closer == -1:
+            position = index if position is None else position
+            break
+        index = closer + len(marker)
+    return position
+
+
+class MarkdownFormatter:
+    """
+    Turns streamed markdown into styled terminal text. Whole lines get block styling; the line in
+    progress is written as far as it is safe to, so text still appears token by token.
+    """
+
+    def __init__(self):
+        self.partial = ''
+        self.partial_since = None
+        # Part of the current line is already on screen, so it can no longer become a heading or fence.
+        self.line_started = False
+        self.in_code = False
+
+    def _line(self, line):
+        started, self.line_started = self.line_started, False
+        if self.in_code and not fence.match(line):
+            return style_code(line) if not started else f"{CODE}{line}{RESET}"
+        if started:
+            return style_inline(line)
+        if fence.match(line):
+            self.in_code = not self.in_code
+            return f"{FENCE}{line}{RESET}"
+        match = heading.match(line)
+        if match:
+            return f"{HEADING}{match.group(2)}{RESET}"
+        return style_inline(line)
+
+    def feed(self, text, final=False):
+        """Adds streamed text and returns what can be written now. final flushes everything held back."""
+        if text and not self.partial:
+            self.partial_since = time.monotonic()
+        self.partial += text
+        out = []
+        while '\n' in self.partial:
+            line, _, self.partial = self.partial.partition('\n')
+            out.append(self._line(line) + '\n')
+            self.partial_since = time.monotonic() if self.partial else None
+        if not self.partial:
+            return "".join(out)
+        if final:
+            out.append(self._line(self.partial))
+            self.partial = ''
+            return "".join(out)
+        if not self.line_started and self.partial.lstrip()[:1] in ('#', '`', ''):
+            # Could still be a heading or a code fence, wait for the rest of the line a little.
+            if time.monotonic() - self.partial_since < HOLD_SECONDS:
+                return "".join(out)
+        if self.in_code:
+            out.append(f"{CODE}{self.partial}{RESET}")
+            self.partial = ''
+            self.line_started = True
+            return "".join(out)
+        cut = _unclosed(self.partial)
+        ready, self.partial = (self.partial, '') if cut is None else (self.partial[:cut], self.partial[cut:])
+        if ready:
+            out.append(style_inline(ready))
+            self.line_started = True
+        return "".join(out)
+
+
+class Renderer:
+    """
+    Collects streamed text from write() and puts it on the terminal renderFPS times a second from a
+    background thread. Writes go to whatever sys.stdout is at the time, so output lands above the
+    prompt when prompt_toolkit's patch_stdout is active.
+    """
+
+    def __init__(self, fps=None, markdown=None, stream=None):
+        self.interval = 1.0 / (fps or renderFPS)
+        use_markdown = renderMarkdown if markdown is None else markdown
+        self.formatter = MarkdownFormatter() if use_markdown else None
+        self.stream = stream
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, text):
+        with self._lock:
+            self._pending.append(text)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def flush(self, final=False):
+        with self._flush_lock:
+            with self._lock:
+                text = "".join(self._pending)
+                self._pending.clear()
+            if self.formatter is not None:
+                text = self.formatter.feed(text, final)
+            if text:
+                stream = self.stream or sys.stdout
+                stream.write(text)
+                stream.flush()
+
+    def close(self):
+        """Stops the frame thread and writes everything still buffered."""
+        self._stop.set()
+        self._thread.join()
+        self.flush(final=True)
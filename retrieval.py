@@ -0,0 +1,363 @@
+"""
+This module indexes files and directories added with @ and retrieves only the chunks
+relevant to each question, instead of putting whole files into the conversation.
+The index lives on disk and is updated incrementally by file mtime and size.
+"""
+
+import glob
+import math
+import mmap
+import os
+import re
+import sqlite3
+import threading
+
+import cache
+
+retrievalTopK = int(os.environ.get('retrievalTopK') or 6)
+# Attachments smaller than this in total are sent whole, pinned after the system prompt so they stay cached.
+retrievalWholeChars = int(os.environ.get('retrievalWholeChars') or 12000)
+maxIndexFileBytes = int(os.environ.get('maxIndexFileBytes') or 5 * 1024 * 1024)
+
+CHUNK_LINES = 40
+# Minified and generated files can have huge lines, so chunks are also cut at this many bytes.
+CHUNK_BYTES = 4096
+# Bumped when chunking changes, so files indexed the old way are indexed again.
+INDEX_VERSION = 1
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+skipped_dirs = {'.git', '.hg', '.svn', 'node_modules', '__pycache__', '.venv', 'venv', '.tox', '.mypy_cache', 'dist', 'build'}
+word = re.compile(r"[A-Za-z_][A-Za-z0-9_]+")
+
+_conn = None
+_lock = threading.Lock()
+
+# Files attached to this session with @, in the order they were added, with their size in bytes.
+attached = {}
+# Path -> name shown to the model, relative to the directory it was attached from. Fixed at attach time,
+# so a cd doesn't change the pinned message and break the cached prompt prefix.
+display_names = {}
+# Bumped whenever the attached files or their index change, so search can keep its chunk table between turns.
+_generation = 0
+# (generation, {chunk id: row}, average chunk length) of the last search.
+_search_rows = (None, None, None)
+
+
+def _connect():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(os.path.join(cache.config_dir(), 'index.db'), check_same_thread=False)
+        _conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime REAL NOT NULL, size INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                path TEXT NOT NULL,
+                start_line INTEGER NOT NULL,
+                start_byte INTEGER NOT NULL,
+                end_byte INTEGER NOT NULL,
+                length INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chunks_path ON chunks(path);
+            CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, chunk_id INTEGER NOT NULL, tf INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS postings_term ON postings(term);
+            CREATE INDEX IF NOT EXISTS postings_chunk ON postings(chunk_id);
+        """)
+        if _conn.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+            _conn.executescript(f"""
+                DELETE FROM postings; DELETE FROM chunks; DELETE FROM files;
+                PRAGMA user_version = {INDEX_VERSION};
+            """)
+    return _conn
+
+
+def tokenize(text):
+    """Lowercased identifiers plus their snake_case parts."""
+    terms = []
+    for match in word.findall(text):
+        lowered = match.lower()
+        terms.append(lowered)
+        if '_' in lowered:
+            terms.extend(part for part in lowered.split('_') if len(part) > 1)
+    return terms
+
+
+def expand(pattern, base_directory, too_big=None):
+    """
+    Turns an @ argument (file, directory or glob) into a list of absolute file paths.
+    Files that can't be read (broken links, deleted meanwhile) are left out, and ones over
+    maxIndexFileBytes are added to too_big instead.
+    """
+    path = os.path.expanduser(pattern)
+    if not os.path.isabs(path):
+        path = os.path.join(base_directory, path)
+    if any(ch in pattern for ch in '*?['):
+        candidates = glob.glob(path, recursive=True)
+    else:
+        candidates = [path]
+    files = []
+    for candidate in candidates:
+        if os.path.isdir(candidate):
+            for root, dirs, names in os.walk(candidate):
+                dirs[:] = [d for d in dirs if d not in skipped_dirs and not d.startswith('.')]
+                files.extend(os.path.join(root, name) for name in names)
+        elif os.path.isfile(candidate):
+            files.append(candidate)
+    readable = []
+    for f in files:
+        try:
+            size = os.stat(f).st_size
+        except OSError:
+            continue
+        if size > maxIndexFileBytes:
+            if too_big is not None:
+                too_big.append(f)
+            continue
+        readable.append(os.path.abspath(f))
+    return readable
+
+
+def _chunks(mapped):
+    """
+    Yields (start_line, start_byte, end_byte) for runs of up to CHUNK_LINES whole lines and CHUNK_BYTES bytes.
+    A line longer than CHUNK_BYTES is split over several chunks, between UTF-8 characters.
+    """
+    position, line, size = 0, 1, len(mapped)
+    while position < size:
+        limit = min(position + CHUNK_BYTES, size)
+        end, lines = position, 0
+        while lines < CHUNK_LINES and end < limit:
+            newline = mapped.find(b'\n', end, limit)
+            if newline == -1:
+                if limit == size:
+                    end = size
+                break
+            end = newline + 1
+            lines += 1
+        if end == position:
+            end = limit
+            while end > position + 1 and mapped[end] & 0xC0 == 0x80:
+                end -= 1
+        yield line, position, end
+        line += lines
+        position = end
+
+
+def _index_file(conn, path, stat):
+    conn.execute("DELETE FROM postings WHERE chunk_id IN (SELECT id FROM chunks WHERE path = ?)", (path,))
+    conn.execute("DELETE FROM chunks WHERE path = ?", (path,))
+    conn.execute("INSERT OR REPLACE INTO files (path, mtime, size) VALUES (?, ?, ?)", (path, stat.st_mtime, stat.st_size))
+    if stat.st_size == 0:
+        return
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        if b'\0' in mapped[:1024]:
+            return
+        for start_line, start, end in _chunks(mapped):
+            terms = tokenize(mapped[start:end].decode('utf-8', errors='ignore'))
+            cursor = conn.execute(
+                "INSERT INTO chunks (path, start_line, start_byte, end_byte, length) VALUES (?, ?, ?, ?, ?)",
+                (path, start_line, start, end, len(terms)),
+            )
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            conn.executemany(
+                "INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)",
+                [(term, cursor.lastrowid, tf) for term, tf in counts.items()],
+            )
+
+
+def update(paths):
+    """Indexes new or changed files and refreshes the sizes of attached ones. Returns how many files were (re)indexed."""
+    changed = 0
+    with _lock:
+        conn = _connect()
+        known = {path: (mtime, size) for path, mtime, size in conn.execute("SELECT path, mtime, size FROM files")}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                if path in attached:
+                    attached[path] = 0
+                continue
+            if path in attached:
+                attached[path] = stat.st_size
+            if stat.st_size > maxIndexFileBytes:
+                continue
+            if known.get(path) == (stat.st_mtime, stat.st_size):
+                continue
+            try:
+                _index_file(conn, path, stat)
+                changed += 1
+            except (OSError, ValueError):
+                continue
+        conn.commit()
+    if changed:
+        _changed()
+    return changed
+
+
+def _changed():
+    global _generation
+    _generation += 1
+
+
+def _display_name(path, base_directory):
+    try:
+        return os.path.relpath(path, base_directory) if base_directory else path
+    except ValueError:
+        return path
+
+
+def attach(patterns, base_directory):
+    """
+    Indexes and attaches the files matched by @ arguments.
+    Returns (files attached, files (re)indexed).
+    """
+    files = []
+    too_big = []
+    for pattern in patterns:
+        skipped = len(too_big)
+        matched = expand(pattern, base_directory, too_big)
+        if not matched and len(too_big) == skipped:
+            print(f"\x1b[91mError: Nothing found at '{pattern}'\x1b[0m")
+        files.extend(matched)
+    if too_big:
+        names = ", ".join(os.path.relpath(f, base_directory) for f in too_big[:5]) + (", ..." if len(too_big) > 5 else "")
+        print(f"\x1b[90mSkipped {len(too_big)} file(s) over maxIndexFileBytes ({maxIndexFileBytes} bytes): {names}\x1b[0m")
+    for path in files:
+        attached.setdefault(path, 0)
+        display_names.setdefault(path, _display_name(path, base_directory))
+    _changed()
+    changed = update(files)
+    return len(files), changed
+
+
+def clear():
+    attached.clear()
+    display_names.clear()
+    _changed()
+
+
+def refresh():
+    """Re-indexes attached files edited since they were attached. Once per turn, before building its context."""
+    if attached:
+        update(list(attached))
+
+
+def fits_whole():
+    """True when the attached files together are small enough to send whole (or nothing is attached)."""
+    return sum(attached.values()) <= retrievalWholeChars
+
+
+def _read(path, start, end):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < end:
+            return ''
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return mapped[start:end].decode('utf-8', errors='ignore')
+
+
+def _chunk_rows(conn, paths, ordered=True):
+    """The chunks of paths, in the order of paths and then by position in the file when ordered."""
+    rows = []
+    # Batched, since SQLite limits the number of parameters in a query.
+    for start in range(0, len(paths), 500):
+        batch = paths[start:start + 500]
+        rows.extend(conn.execute(
+            "SELECT id, path, start_line, start_byte, end_byte, length FROM chunks WHERE path IN "
+            f"({','.join('?' * len(batch))})", batch
+        ).fetchall())
+    if ordered:
+        order = {path: position for position, path in enumerate(paths)}
+        rows.sort(key=lambda row: (order[row[1]], row[3]))
+    return rows
+
+
+def whole():
+    """
+    Returns every attached chunk as (path, start_line, text) in attach order when they fit
+    retrievalWholeChars together, or None when they have to be searched instead.
+    """
+    if not attached or not fits_whole():
+        return None
+    with _lock:
+        rows = _chunk_rows(_connect(), list(attached))
+    if not rows:
+        return None
+    return [(row[1], row[2], _read(row[1], row[3], row[4])) for row in rows]
+
+
+def search(question, k=None):
+    """
+    Returns the top k attached chunks for question as (path, start_line, text), ranked by BM25.
+    Call refresh() first in a turn so edited files are re-indexed and offsets stay valid.
+    """
+    global _search_rows
+    k = k or retrievalTopK
+    paths = list(attached)
+    if not paths:
+        return []
+    with _lock:
+        conn = _connect()
+        generation, chunks, average_length = _search_rows
+        if generation != _generation:
+            rows = _chunk_rows(conn, paths, ordered=False)
+            chunks = {row[0]: row for row in rows}
+            average_length = (sum(row[5] for row in rows) / len(rows) or 1) if rows else 1
+            _search_rows = (_generation, chunks, average_length)
+        if not chunks:
+            return []
+        terms = set(tokenize(question))
+        scores = {}
+        for term in terms:
+            postings = [(chunk_id, tf) for chunk_id, tf in conn.execute(
+                "SELECT chunk_id, tf FROM postings WHERE term = ?", (term,)
+            ) if chunk_id in chunks]
+            if not postings:
+                continue
+            idf = math.log(1 + (len(chunks) - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, tf in postings:
+                length = chunks[chunk_id][5]
+                score = idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length))
+                scores[chunk_id] = scores.get(chunk_id, 0) + score
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    # Keep the excerpts in file order so neighbouring chunks read naturally.
+    order = {path: position for position, path in enumerate(paths)}
+    best.sort(key=lambda chunk_id: (order[chunks[chunk_id][1]], chunks[chunk_id][3]))
+    return [(chunks[c][1], chunks[c][2], _read(chunks[c][1], chunks[c][3], chunks[c][4])) for c in best]
+
+
+def _format(results):
+    parts = []
+    for path, start_line, text in results:
+        name = display_names.get(path, path)
+        end_line = start_line + text.count('\n')
+        parts.append(f"--- {name} (lines {start_line}-{end_line}) ---\n{text}")
+    return "\n".join(parts)
+
+
+def pinned_messages():
+    """
+    Builds the message with the attached files whole, to send right after the system prompt on every turn,
+    or [] when nothing is attached or they're too big and are searched per question instead.
+    The same files give the same bytes, so the message stays part of the cached prompt prefix.
+    """
+    results = whole()
+    if not results:
+        return []
+    return [{"role": "user", "content": "The files the user attached:\n\n" + _format(results)}]
+
+
+def context_messages(question):
+    """
+    Builds the per-turn context message with the excerpts relevant to question, or [] if nothing is attached
+    or the attachments are small enough to be pinned whole.
+    """
+    if fits_whole():
+        return []
+    results = search(question)
+    if not results:
+        return []
+    content = "Relevant excerpts from the files the user attached:\n\n" + _format(results)
+    return [{"role": "user", "content": content}]
@@ -0,0 +1,13 @@
+"""
+This module reads on/off settings from the environment (and so from .env) the same way everywhere.
+"""
+
+import os
+
+
+def flag(name, default=False):
+    """True if name is set to 1, true, yes or on (any case), default when it is unset or empty."""
+    value = os.environ.get(name)
+    if not value:
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
@@ -0,0 +1,208 @@
+"""
+This module keeps one long-lived bash or PowerShell process for the whole Codriver session.
+Each command is framed with sentinel markers so its output, exit code and the new working
+directory can be recovered, and exports, functions and activated virtualenvs carry over.
+"""
+
+import base64
+import codecs
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import profiling
+import settings
+from executor import commandTimeout, make_capture
+
+os_type = 'linux' if os.name == 'posix' else 'windows'
+
+persistentShell = settings.flag('persistentShell')
+
+READ_SIZE = 64 * 1024
+
+
+class ShellSession:
+    """A persistent shell that runs one framed command at a time."""
+
+    def __init__(self, cwd=None):
+        self.sentinel = f"__CODRIVER_{uuid.uuid4().hex}__"
+        self.lock = threading.Lock()
+        self.proc = None
+        self.cwd = cwd or os.getcwd()
+        self._start()
+
+    def _start(self):
+        if os_type == 'windows':
+            args = ["powershell", "-NoLogo", "-NoProfile", "-ExecutionPolicy", "Bypass", "-Command", "-"]
+        else:
+            args = ["bash", "--noprofile", "--norc", "-s"]
+        self.proc = subprocess.Popen(
+            args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=self.cwd, bufsize=0,
+        )
+        self.chunks = queue.Queue()
+        for name, pipe in (('out', self.proc.stdout), ('err', self.proc.stderr)):
+            threading.Thread(target=self._pump, args=(name, pipe, self.chunks), daemon=True).start()
+        if os_type == 'windows':
+            self._send("[Console]::OutputEncoding = [Text.Encoding]::UTF8\n")
+        else:
+            # A trap (rather than ignoring SIGINT) keeps the shell alive on Ctrl-C while its children still get the signal.
+            self._send("trap : INT\nshopt -s expand_aliases\n")
+
+    @staticmethod
+    def _pump(name, pipe, chunks):
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        while True:
+            data = pipe.read1(READ_SIZE) if hasattr(pipe, 'read1') else os.read(pipe.fileno(), READ_SIZE)
+            if not data:
+                break
+            text = decoder.decode(data)
+            if text:
+                chunks.put((name, text))
+        chunks.put((name, None))
+
+    def _send(self, text):
+        self.proc.stdin.write(text.encode('utf-8'))
+        self.proc.stdin.flush()
+
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def restart(self):
+        """Kills the shell and starts a fresh one in the last known directory."""
+        self.close()
+        self._start()
+
+    def close(self):
+        if self.alive():
+            try:
+                self.proc.kill()
+                self.proc.wait(timeout=2)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+
+    def _frame(self, cmd):
+        """Wraps cmd so it runs in the current shell scope and is followed by the sentinel lines."""
+        if os_type == 'windows':
+            encoded = base64.b64encode(cmd.encode('utf-8')).decode('ascii')
+            return (
+                f"$__codriver_ok = $true; try {{ . ([scriptblock]::Create([Text.Encoding]::UTF8.GetString("
+                f"[Convert]::FromBase64String('{encoded}')))); $__codriver_ok = $? }} "
+                f"catch {{ [Console]::Error.WriteLine($_); $__codriver_ok = $false }}; "
+                f"$__codriver_rc = if ($__codriver_ok) {{ if ($LASTEXITCODE) {{ $LASTEXITCODE }} else {{ 0 }} }} "
+                f"else {{ if ($LASTEXITCODE) {{ $LASTEXITCODE }} else {{ 1 }} }}; $global:LASTEXITCODE = 0; "
+                f"[Console]::Out.WriteLine(\"`n{self.sentinel} $__codriver_rc $((Get-Location).Path)\"); "
+                f"[Console]::Error.WriteLine(\"`n{self.sentinel}\")\n"
+            )
+        quoted = cmd.replace("'", "'\\''")
+        # The shell reads its commands from stdin, so the command gets the terminal (sudo prompts, read)
+        # when there is one, like in a new shell, and never the commands queued after it.
+        stdin = '/dev/tty' if sys.stdin is not None and sys.stdin.isatty() else '/dev/null'
+        return (
+            f"eval '{quoted}' <{stdin}\n"
+            f"__codriver_rc=$?; printf '\\n%s %d %s\\n' '{self.sentinel}' \"$__codriver_rc\" \"$PWD\"; "
+            f"printf '\\n%s\\n' '{self.sentinel}' >&2\n"
+        )
+
+    def run(self, cmd, echo=True, timeout=None, max_chars=None):
+        """
+        Runs cmd in the persistent shell, streaming output like executor.run.
+        Returns a subprocess.CompletedProcess with an extra cwd attribute holding the shell's new directory.
+        """
+        with self.lock:
+            if not self.alive():
+                self._start()
+            timeout = commandTimeout if timeout is None else timeout
+            buffers = {'out': make_capture(max_chars), 'err': make_capture(max_chars)}
+            streams = {'out': sys.stdout if echo else None, 'err': sys.stderr if echo else None}
+            pending = {'out': '', 'err': ''}
+            done = {'out': False, 'err': False}
+            trailer = ''
+            marker = "\n" + self.sentinel
+            returncode, error = None, ''
+
+            def emit(name, text):
+                if not text:
+                    return
+                buffers[name].write(text)
+                if streams[name] is not None:
+                    streams[name].write(f"\x1b[91m{text}\x1b[0m" if name == 'err' else text)
+                    streams[name].flush()
+
+            # Drop anything a previous command left behind after its sentinel.
+            while True:
+                try:
+                    self.chunks.get_nowait()
+                except queue.Empty:
+                    break
+            started = time.perf_counter()
+            self._send(self._frame(cmd))
+            deadline = time.monotonic() + timeout if timeout else None
+            interrupts = 0
+            # Both streams end with the sentinel, and stdout's is followed by the exit code and directory.
+            while not (all(done.values()) and '\n' in trailer.lstrip(' ')):
+                if deadline and time.monotonic() > deadline:
+                    error = f"\nError: Command timed out after {timeout:g} seconds."
+                    returncode = -9
+                    self.restart()
+                    break
+                try:
+                    name, text = self.chunks.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                except KeyboardInterrupt:
+                    interrupts += 1
+                    if interrupts == 1:
+                        print("\n\x1b[90m^C sent to command, press Ctrl-C again to restart the shell.\x1b[0m")
+                        continue
+                    returncode = -2
+                    self.restart()
+                    break
+                if text is None:
+                    # The shell itself exited, e.g. the command was 'exit'.
+                    if not done[name]:
+                        emit(name, pending[name])
+                    returncode = self.proc.wait()
+                    error = "\nShell exited, starting a new one."
+                    self._start()
+                    break
+                if done[name]:
+                    if name == 'out':
+                        trailer += text
+                    continue
+                pending[name] += text
+                index = pending[name].find(marker)
+                if index != -1:
+                    emit(name, pending[name][:index])
+                    done[name] = True
+                    if name == 'out':
+                        trailer = pending[name][index + len(marker):]
+                    continue
+                # Hold back anything that could be the start of the marker.
+                keep = len(marker) - 1
+                emit(name, pending[name][:-keep] if len(pending[name]) > keep else '')
+                pending[name] = pending[name][-keep:] if len(pending[name]) > keep else pending[name]
+            if returncode is None:
+                status = trailer.strip().split(' ', 1)
+                returncode = int(status[0])
+                if len(status) > 1:
+                    self.cwd = status[1].strip()
+            profiling.add_span('subprocess', time.perf_counter() - started)
+            profiling.record('output_bytes', buffers['out'].total + buffers['err'].total)
+            result = subprocess.CompletedProcess(cmd, returncode, buffers['out'].getvalue(), buffers['err'].getvalue() + error)
+            result.cwd = self.cwd
+            return result
+
+
+_session = None
+
+
+def get_session(cwd=None):
+    """Returns the session's shared persistent shell, starting it on first use."""
+    global _session
+    if _session is None:
+        _session = ShellSession(cwd)
+    return _session
@@ -0,0 +1,188 @@
+"""
+This module implements watch mode ('tail -f app.log |?~ alert me on errors'): the command's output
+is read as a stream, windowed by time and lines, filtered locally for interesting lines and
+deduplicated, and only new lines are sent to the model, no more often than a minimum interval.
+The model keeps a rolling summary that is carried forward, so memory and tokens stay flat
+however long the stream runs.
+"""
+
+import collections
+import io
+import os
+import queue
+import re
+import subprocess
+import sys
+import threading
+import time
+
+import executor
+import modellogic
+import reducer
+
+# A window of output is sent after this many seconds, or sooner once it holds watchWindowLines new lines.
+watchWindowSeconds = float(os.environ.get('watchWindowSeconds') or 10)
+watchWindowLines = int(os.environ.get('watchWindowLines') or 200)
+# Never call the model more often than this, windows in between are merged.
+watchMinInterval = float(os.environ.get('watchMinInterval') or 30)
+# Lines worth sending to the model, errors and warnings by default.
+watchPattern = re.compile(os.environ['watchPattern'], re.IGNORECASE) if os.environ.get('watchPattern') else reducer.important
+
+# Line signatures already reported to the model, oldest forgotten first.
+SEEN_LIMIT = 5000
+# Lines buffered between the reader and the watcher; past this the reader drops lines rather than stall the command.
+QUEUE_LIMIT = 10000
+MAX_LINE_CHARS = 500
+
+_EOF = object()
+
+
+class Watcher:
+    """Windows, filters and deduplicates lines. Knows nothing about processes or the model."""
+
+    def __init__(self, pattern=None, window_seconds=None, window_lines=None, min_interval=None):
+        self.pattern = pattern or watchPattern
+        self.window_seconds = watchWindowSeconds if window_seconds is None else window_seconds
+        self.window_lines = window_lines or watchWindowLines
+        self.min_interval = watchMinInterval if min_interval is None else min_interval
+        self.seen = collections.OrderedDict()
+        self.last_sent = float('-inf')
+        self.total = 0
+        self._open_window()
+
+    def _open_window(self):
+        # signature -> [first line, count] of new interesting lines in this window
+        self.pending = collections.OrderedDict()
+        self.opened = time.monotonic()
+        self.window_total = 0
+        self.repeats = 0
+        self.overflow = 0
+
+    def add(self, line):
+        self.total += 1
+        self.window_total += 1
+        line = reducer.ansi_escape.sub('', line).rstrip()
+        if not line or reducer.progress_bar.search(line) or not self.pattern.search(line):
+            return
+        key = reducer.signature(line)
+        if key in self.seen:
+            self.seen.move_to_end(key)
+            self.repeats += 1
+        elif key in self.pending:
+            self.pending[key][1] += 1
+        elif len(self.pending) < self.window_lines:
+            self.pending[key] = [line[:MAX_LINE_CHARS], 1]
+        else:
+            self.overflow += 1
+
+    def due(self, now=None):
+        """True when the window has new lines, is old or full enough, and the last call was long enough ago."""
+        if not self.pending:
+            return False
+        now = time.monotonic() if now is None else now
+        ready = now - self.opened >= self.window_seconds or len(self.pending) >= self.window_lines
+        return ready and now - self.last_sent >= self.min_interval
+
+    def take(self):
+        """Returns the window as text for the model, remembers its lines as reported and starts a new window."""
+        lines = [f"{line} (x{count})" if count > 1 else line for line, count in self.pending.values()]
+        header = f"[{self.window_total} lines since the last update, {len(self.pending)} new interesting"
+        if self.repeats:
+            header += f", {self.repeats} repeats of lines already reported"
+        if self.overflow:
+            header += f", {self.overflow} more new lines not shown"
+        for key in self.pending:
+            self.seen[key] = True
+        while len(self.seen) > SEEN_LIMIT:
+            self.seen.popitem(last=False)
+        self.last_sent = time.monotonic()
+        self._open_window()
+        return header + "]\n" + "\n".join(lines)
+
+
+def _read_lines(pipe, lines, dropped):
+    for line in io.TextIOWrapper(pipe, encoding='utf-8', errors='replace'):
+        try:
+            lines.put_nowait(line)
+        except queue.Full:
+            dropped[0] += 1
+    lines.put(_EOF)
+
+
+def run(command, instruction, cwd=None, echo=True, ask=None):
+    """
+    Runs command and watches its output until it exits or Ctrl-C is pressed, printing an alert
+    whenever the model finds something the instruction asks about. ask(excerpt, summary) returns
+    (alert or None, summary) and defaults to modellogic.watch_update. Returns the final summary.
+    """
+    ask = ask or (lambda excerpt, summary: modellogic.watch_update(command, instruction, summary, excerpt))
+    watcher = Watcher()
+    summary = ''
+    args, shell = executor.shell_args(command)
+    proc = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            shell=shell, cwd=cwd, **executor.process_group())
+    lines = queue.Queue(maxsize=QUEUE_LIMIT)
+    dropped = [0]
+    threading.Thread(target=_read_lines, args=(proc.stdout, lines, dropped), daemon=True).start()
+
+    # One model call at a time runs in the background so reading never stops.
+    call = {'thread': None, 'result': None, 'error': None}
+
+    def start_call(excerpt, current_summary):
+        def target():
+            try:
+                call['result'] = ask(excerpt, current_summary)
+            except Exception as e:
+                call['error'] = e
+        call['thread'] = threading.Thread(target=target, daemon=True)
+        call['thread'].start()
+
+    def collect(wait=False):
+        nonlocal summary
+        thread = call['thread']
+        if thread is None or (thread.is_alive() and not wait):
+            return
+        thread.join()
+        call['thread'] = None
+        if call['error'] is not None:
+            print(f"\n\x1b[91mWatch update failed: {call['error']}\x1b[0m")
+        elif call['result'] is not None:
+            alert, summary = call['result']
+            if alert:
+                print(f"\n\033[94mCodriver:\033[0m \x1b[93m{alert}\x1b[0m\n")
+        call['result'] = call['error'] = None
+
+    print(f"\x1b[90mWatching '{command}', Ctrl-C to stop.\x1b[0m")
+    try:
+        while True:
+            try:
+                line = lines.get(timeout=0.25)
+            except queue.Empty:
+                line = None
+            if line is _EOF:
+                break
+            if line is not None:
+                if echo:
+                    sys.stdout.write(line)
+                    sys.stdout.flush()
+                watcher.add(line)
+            collect()
+            if call['thread'] is None and watcher.due():
+                start_call(watcher.take(), summary)
+    except KeyboardInterrupt:
+        print("\n\x1b[90mStopped watching.\x1b[0m")
+    finally:
+        if proc.poll() is None:
+            executor.kill_group(proc)
+        proc.wait()
+    try:
+        collect(wait=True)
+        # Whatever the stream ended with still gets looked at once.
+        if watcher.pending:
+            start_call(watcher.take(), summary)
+            collect(wait=True)
+    except KeyboardInterrupt:
+        pass
+    if dropped[0]:
+        print(f"\x1b[90m({dropped[0]} lines arrived faster than they could be read and were skipped)\x1b[0m")
+    return summary